@@ -0,0 +1,613 @@
+# -*- encoding: utf-8
+"""
+Line buffers for storing the lines of a viewer.
+
+Buffers behave like a list of Line instances so that existing code can keep
+using indexing, slicing, insert and pop. Backends can be selected with the
+'line_buffer' editor config option.
+"""
+
+import os
+import mmap
+import bisect
+try:
+    from collections.abc import MutableSequence
+except ImportError:
+    from collections import MutableSequence
+from collections import OrderedDict
+
+from .line import Line
+
+
+class ChangeTracker(object):
+    """Keeps track of the range of lines that changed in a buffer.
+
+    The range is kept in current line coordinates. Lines before 'start' are
+    untouched and lines after 'end' have only been shifted by 'delta'.
+    """
+
+    def __init__(self):
+        self.buffer = None
+        self.reset()
+
+    def reset(self):
+        """Forget all tracked changes."""
+        self.start = None
+        self.end = None
+        self.delta = 0
+        # Lines whose contents changed, resolved to indices when needed
+        self.lines = set()
+
+    def has_changes(self):
+        """Check if any changes have been tracked."""
+        return self.start is not None or bool(self.lines)
+
+    def replaced(self, i, removed, added):
+        """Track replacing lines [i, i+removed) with 'added' new lines."""
+        if self.start is None:
+            self.start = i
+            self.end = i + added
+        else:
+            end = self.end
+            if end >= i + removed:
+                end += added - removed
+            elif end > i:
+                end = i + added
+            self.start = min(self.start, i)
+            self.end = max(end, i + added)
+        self.delta += added - removed
+
+    def take(self):
+        """Return and reset the changed range.
+
+        :return: Tuple (start, old_end, new_end) or None if nothing changed.
+        """
+        for line in self.lines:
+            index = self.buffer.index_of(line)
+            if index is not None:
+                self.replaced(index, 1, 1)
+        if self.start is None:
+            self.reset()
+            return None
+        changed = (self.start, self.end - self.delta, self.end)
+        self.reset()
+        return changed
+
+
+class LineBuffer(MutableSequence):
+    """Line buffer backed by a plain Python list."""
+
+    def __init__(self, lines=None):
+        self.lines = []
+        self.trackers = []
+        # LineMetadata for the attributes of the lines
+        self.metadata = None
+        if lines is not None:
+            self.extend(lines)
+
+    def _wrap(self, item, owner):
+        """Return item as a Line instance owned by owner."""
+        if not isinstance(item, Line):
+            item = Line(item)
+        item.set_owner(owner)
+        return item
+
+    def _replaced(self, i, removed, added):
+        for tracker in self.trackers:
+            tracker.replaced(i, removed, added)
+
+    def _normalize(self, i):
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError("line index out of range")
+        return i
+
+    def _slice_range(self, i):
+        start, stop, step = i.indices(len(self))
+        if step != 1:
+            # Extended slices are rare, just mark the whole buffer
+            return 0, len(self)
+        return start, max(start, stop)
+
+    def add_tracker(self, tracker):
+        """Register a ChangeTracker to be notified of changes."""
+        tracker.buffer = self
+        self.trackers.append(tracker)
+
+    def remove_tracker(self, tracker):
+        """Stop notifying a ChangeTracker of changes."""
+        if tracker in self.trackers:
+            self.trackers.remove(tracker)
+
+    def adopt_trackers(self, other):
+        """Move the trackers of another buffer to this one, marking everything changed."""
+        for tracker in other.trackers:
+            tracker.replaced(0, len(other), len(self))
+            self.add_tracker(tracker)
+        other.trackers = []
+
+    def line_changed(self, line):
+        """Called by Line instances when their data changes."""
+        for tracker in self.trackers:
+            tracker.lines.add(line)
+
+    def index_of(self, line):
+        """Return the index of a Line instance or None if it's not in the buffer."""
+        try:
+            return self.lines.index(line)
+        except ValueError:
+            return None
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __getitem__(self, i):
+        return self.lines[i]
+
+    def __setitem__(self, i, v):
+        if isinstance(i, slice):
+            start, stop = self._slice_range(i)
+            length = len(self)
+            self.lines[i] = [self._wrap(item, self) for item in v]
+            self._replaced(start, stop - start, stop - start + len(self) - length)
+        else:
+            i = self._normalize(i)
+            self.lines[i] = self._wrap(v, self)
+            self._replaced(i, 1, 1)
+
+    def __delitem__(self, i):
+        if isinstance(i, slice):
+            start, stop = self._slice_range(i)
+            length = len(self)
+            del self.lines[i]
+            self._replaced(start, stop - start, stop - start + len(self) - length)
+        else:
+            i = self._normalize(i)
+            del self.lines[i]
+            self._replaced(i, 1, 0)
+
+    def __iter__(self):
+        return iter(self.lines)
+
+    def insert(self, i, v):
+        i = max(0, min(len(self), i if i >= 0 else i + len(self)))
+        self.lines.insert(i, self._wrap(v, self))
+        self._replaced(i, 0, 1)
+
+    def extend(self, lines):
+        self.insert_lines(len(self), lines)
+
+    def insert_lines(self, i, lines):
+        """Insert multiple lines at index i."""
+        self[i:i] = lines
+
+    def iter_data(self, start=0, stop=None):
+        """Iterate over the line contents as strings."""
+        for line in self.lines[start:stop]:
+            yield line.get_data()
+
+
+class Block(object):
+    """A block of lines in a ChunkedLineBuffer."""
+    __slots__ = ("lines", "buffer")
+
+    def __init__(self, buffer, lines=None):
+        self.buffer = buffer
+        self.lines = lines or []
+        for item in self.lines:
+            if isinstance(item, Line):
+                item.set_owner(self)
+
+    def line_changed(self, line):
+        self.buffer.line_changed(line)
+
+    @property
+    def metadata(self):
+        return self.buffer.metadata
+
+
+class ChunkedLineBuffer(LineBuffer):
+    """Line buffer storing lines in blocks indexed by a Fenwick tree.
+
+    Inserting or removing a line only touches a single block and the block
+    size index, so line operations stay fast on files with millions of lines.
+    Lines are stored as plain strings and only wrapped into Line instances
+    when they are accessed.
+    """
+
+    block_size = 512
+
+    def __init__(self, lines=None):
+        self.blocks = [Block(self)]
+        self.length = 0
+        self.tree = []
+        self.trackers = []
+        self.metadata = None
+        self._rebuild_index()
+        if lines is not None:
+            self.extend(lines)
+
+    def _rebuild_index(self):
+        """Build the Fenwick tree of block sizes."""
+        n = len(self.blocks)
+        tree = [0] * (n + 1)
+        for b, block in enumerate(self.blocks):
+            i = b + 1
+            tree[i] += len(block.lines)
+            parent = i + (i & -i)
+            if parent <= n:
+                tree[parent] += tree[i]
+        self.tree = tree
+        self.step = 1
+        while self.step * 2 <= n:
+            self.step *= 2
+
+    def _update_index(self, b, delta):
+        """Add delta to the size of block b."""
+        self.length += delta
+        tree = self.tree
+        n = len(tree) - 1
+        i = b + 1
+        while i <= n:
+            tree[i] += delta
+            i += i & -i
+
+    def _prefix(self, b):
+        """Return the index of the first line in block b."""
+        total = 0
+        tree = self.tree
+        while b > 0:
+            total += tree[b]
+            b -= b & -b
+        return total
+
+    def _locate(self, i):
+        """Return the block index and offset within the block for line i."""
+        tree = self.tree
+        n = len(tree) - 1
+        pos = 0
+        step = self.step
+        while step:
+            nxt = pos + step
+            if nxt <= n and tree[nxt] <= i:
+                pos = nxt
+                i -= tree[nxt]
+            step //= 2
+        return pos, i
+
+    def _split_block(self, b):
+        """Split block b into blocks of the default size."""
+        lines = self.blocks[b].lines
+        size = self.block_size
+        parts = [Block(self, lines[k:k + size]) for k in range(0, len(lines), size)]
+        self.blocks[b:b + 1] = parts or [Block(self)]
+        self._rebuild_index()
+
+    def _remove_empty_blocks(self):
+        blocks = [block for block in self.blocks if block.lines]
+        self.blocks = blocks or [Block(self)]
+        self._rebuild_index()
+
+    def index_of(self, line):
+        """Return the index of a Line instance or None if it's not in the buffer."""
+        block = line._owner
+        if block is None or block.buffer is not self:
+            return None
+        try:
+            b = self.blocks.index(block)
+            j = block.lines.index(line)
+        except ValueError:
+            return None
+        return self._prefix(b) + j
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(self.length)
+            if step != 1:
+                return [self[k] for k in range(start, stop, step)]
+            return list(self._iter_range(start, stop))
+        b, j = self._locate(self._normalize(i))
+        block = self.blocks[b]
+        item = block.lines[j]
+        if not isinstance(item, Line):
+            item = self._wrap(item, block)
+            block.lines[j] = item
+        return item
+
+    def __setitem__(self, i, v):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(self.length)
+            if step != 1:
+                raise ValueError("extended slice assignment isn't supported")
+            lines = list(v)
+            if stop > start:
+                del self[start:stop]
+            self.insert_lines(start, lines)
+            return
+        i = self._normalize(i)
+        b, j = self._locate(i)
+        block = self.blocks[b]
+        block.lines[j] = self._wrap(v, block)
+        self._replaced(i, 1, 1)
+
+    def __delitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(self.length)
+            if step != 1:
+                for k in sorted(range(start, stop, step), reverse=True):
+                    del self[k]
+                return
+            self._delete_range(start, stop)
+            return
+        i = self._normalize(i)
+        b, j = self._locate(i)
+        block = self.blocks[b]
+        del block.lines[j]
+        self._update_index(b, -1)
+        if not block.lines and len(self.blocks) > 1:
+            self._remove_empty_blocks()
+        self._replaced(i, 1, 0)
+
+    def _delete_range(self, start, stop):
+        """Delete lines from start up to (but not including) stop."""
+        if stop <= start:
+            return
+        b, j = self._locate(start)
+        remaining = stop - start
+        while remaining > 0:
+            lines = self.blocks[b].lines
+            count = min(remaining, len(lines) - j)
+            del lines[j:j + count]
+            self._update_index(b, -count)
+            remaining -= count
+            b += 1
+            j = 0
+        self._remove_empty_blocks()
+        self._replaced(start, stop - start, 0)
+
+    def _iter_range(self, start, stop):
+        """Iterate over Line instances from start to stop."""
+        if stop <= start:
+            return
+        b, j = self._locate(start)
+        count = stop - start
+        while count > 0:
+            block = self.blocks[b]
+            lines = block.lines
+            end = min(len(lines), j + count)
+            for k in range(j, end):
+                item = lines[k]
+                if not isinstance(item, Line):
+                    item = self._wrap(item, block)
+                    lines[k] = item
+                yield item
+            count -= end - j
+            b += 1
+            j = 0
+
+    def __iter__(self):
+        return self._iter_range(0, self.length)
+
+    def insert(self, i, v):
+        self.insert_lines(i, [v])
+
+    def insert_lines(self, i, lines):
+        """Insert multiple lines at index i."""
+        lines = list(lines)
+        if not lines:
+            return
+        if i < 0:
+            i = max(0, i + self.length)
+        i = min(i, self.length)
+        if i == self.length:
+            b = len(self.blocks) - 1
+            j = len(self.blocks[b].lines)
+        else:
+            b, j = self._locate(i)
+        block = self.blocks[b]
+        for item in lines:
+            if isinstance(item, Line):
+                item.set_owner(block)
+        block.lines[j:j] = lines
+        self._update_index(b, len(lines))
+        if len(block.lines) > self.block_size * 2:
+            self._split_block(b)
+        self._replaced(i, 0, len(lines))
+
+    def iter_data(self, start=0, stop=None):
+        """Iterate over the line contents as strings."""
+        if stop is None:
+            stop = self.length
+        for item in self._iter_raw(start, stop):
+            if isinstance(item, Line):
+                yield item.get_data()
+            else:
+                yield item
+
+    def _iter_raw(self, start, stop):
+        """Iterate over stored items (strings or Lines) without wrapping them."""
+        if stop <= start:
+            return
+        b, j = self._locate(start)
+        count = stop - start
+        while count > 0:
+            lines = self.blocks[b].lines
+            end = min(len(lines), j + count)
+            for k in range(j, end):
+                yield lines[k]
+            count -= end - j
+            b += 1
+            j = 0
+
+
+class MappedLineBuffer(LineBuffer):
+    """Read only line buffer for viewing huge files.
+
+    The file is memory mapped and lines are only decoded when they are
+    accessed. Line breaks are counted lazily in blocks of 'block_size' bytes,
+    which gives a sparse index for finding the block that a line starts in.
+    Until the whole file is indexed with index_blocks the length of the
+    buffer is the amount of lines found so far. Only ASCII compatible
+    encodings are supported.
+    """
+
+    block_size = 64 * 1024
+    # Amount of blocks to keep decoded
+    cached_blocks = 16
+
+    def __init__(self, path, encoding="utf-8"):
+        self.path = path
+        self.encoding = encoding
+        self.trackers = []
+        self.metadata = None
+        with open(path, "rb") as f:
+            self.size = os.fstat(f.fileno()).st_size
+            if self.size:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.map = b""  # Empty files can't be mapped
+        # Amount of line breaks before each indexed block
+        self.breaks = [0]
+        # Decoded lines by block index
+        self.cache = OrderedDict()
+        # Index enough lines for the first screen
+        self.index_blocks(1)
+
+    def _read_only(self, *args):
+        raise TypeError("line buffer is read only")
+
+    __setitem__ = __delitem__ = insert = insert_lines = line_changed = _read_only
+
+    def _index_blocks(self, count, max_blocks=None):
+        """Index blocks until 'count' line breaks are indexed or the end of the file is reached.
+
+        :param int max_blocks: Maximum amount of blocks to index.
+        """
+        size = self.block_size
+        while self.breaks[-1] < count and max_blocks != 0:
+            start = (len(self.breaks) - 1) * size
+            if start >= self.size:
+                break
+            self.breaks.append(self.breaks[-1] + self.map[start:start + size].count(b"\n"))
+            if max_blocks is not None:
+                max_blocks -= 1
+
+    def index_blocks(self, count):
+        """Index the line breaks in up to 'count' more blocks.
+
+        :return: True if the file isn't fully indexed yet.
+        """
+        length = len(self)
+        # There can't be more line breaks than bytes
+        self._index_blocks(self.size + 1, count)
+        if len(self) > length:
+            # Lines that were found are added to the end
+            self._replaced(length, 0, len(self) - length)
+        return not self.is_indexed()
+
+    def is_indexed(self):
+        """Check if the line breaks of the whole file have been indexed."""
+        return (len(self.breaks) - 1) * self.block_size >= self.size
+
+    def get_index_progress(self):
+        """Return the fraction of the file that has been indexed."""
+        if not self.size:
+            return 1.0
+        return min(1.0, float((len(self.breaks) - 1) * self.block_size) / self.size)
+
+    def _block_lines(self, b):
+        """Return the decoded lines that begin in block b."""
+        lines = self.cache.get(b)
+        if lines is not None:
+            return lines
+        size = self.block_size
+        start = 0
+        if b:
+            # Lines begin after the first line break in the block
+            start = self.map.find(b"\n", b * size, (b + 1) * size) + 1
+        end = self.map.find(b"\n", (b + 1) * size)
+        if end < 0:
+            end = self.size
+        lines = []
+        if b and not start:
+            # No lines begin in this block
+            data = []
+        else:
+            data = self.map[start:end].split(b"\n")
+        for line in data:
+            if line.endswith(b"\r"):
+                line = line[:-1]
+            lines.append(line.decode(self.encoding, "replace"))
+        self.cache[b] = lines
+        if len(self.cache) > self.cached_blocks:
+            self.cache.popitem(last=False)
+        return lines
+
+    def _locate(self, i):
+        """Return the block that line i begins in and the index of the line in the block."""
+        self._index_blocks(i)
+        if i == 0:
+            return 0, 0
+        b = bisect.bisect_left(self.breaks, i) - 1
+        return b, i - self.breaks[b] - (1 if b else 0)
+
+    def index_of(self, line):
+        return None
+
+    def __len__(self):
+        # Only the lines that have been indexed are known to exist
+        return self.breaks[-1] + 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step != 1:
+                return [self[k] for k in range(start, stop, step)]
+            return [self._wrap(data, self) for data in self.iter_data(start, stop)]
+        i = self._normalize(i)
+        b, j = self._locate(i)
+        return self._wrap(self._block_lines(b)[j], self)
+
+    def __iter__(self):
+        for data in self.iter_data():
+            yield self._wrap(data, self)
+
+    def iter_data(self, start=0, stop=None):
+        """Iterate over the line contents as strings.
+
+        Without stop the lines are iterated until the end of the file, even
+        if it hasn't been indexed yet.
+        """
+        if stop is None:
+            if start >= len(self) and self.is_indexed():
+                return
+            b, j = self._locate(start)
+            while b == 0 or b * self.block_size < self.size:
+                for line in self._block_lines(b)[j:]:
+                    yield line
+                b += 1
+                j = 0
+            return
+        stop = min(stop, len(self))
+        if stop <= start:
+            return
+        b, j = self._locate(start)
+        count = stop - start
+        while count > 0:
+            lines = self._block_lines(b)[j:j + count]
+            for line in lines:
+                yield line
+            count -= len(lines)
+            b += 1
+            j = 0
+
+
+# Available line buffer backends
+backends = {
+    "list": LineBuffer,
+    "chunked": ChunkedLineBuffer,
+}
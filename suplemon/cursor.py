@@ -3,31 +3,60 @@
 Cursor object for storing cursor data.
 """
 
+try:
+    from collections.abc import MutableSequence
+except ImportError:
+    from collections import MutableSequence
 
-class Cursor:
+
+class Cursor(object):
     def __init__(self, x=0, y=0):
         """Initialize Cursor.
 
         :param x: Cursor x coordinate or x,y tuple. Defaults to 0.
         :param y: Cursor y coordinate. Defaults to 0.
         """
+        # The CursorSet that is notified when the cursor moves
+        self._owner = None
         # Handle coords as a tuple
         if isinstance(x, tuple) or isinstance(x, list):
             x, y = x
-            self.x = x
-            self.y = y
+            self._x = x
+            self._y = y
         # Handle coords from existing Cursor
         elif isinstance(x, Cursor):  # Handle arguments as a cursor
-            self.x = x.x
-            self.y = x.y
+            self._x = x.x
+            self._y = x.y
         # Handle coords as plain ints
         else:
-            self.x = x
-            self.y = y
+            self._x = x
+            self._y = y
         # Store the desired x position and
         # use it if the line is long enough
         self.persistent_x = self.x
 
+    @property
+    def x(self):
+        return self._x
+
+    @x.setter
+    def x(self, x):
+        old = self._x
+        self._x = x
+        if self._owner is not None and x != old:
+            self._owner.cursor_moved(self, old, self._y)
+
+    @property
+    def y(self):
+        return self._y
+
+    @y.setter
+    def y(self, y):
+        old = self._y
+        self._y = y
+        if self._owner is not None and y != old:
+            self._owner.cursor_moved(self, self._x, old)
+
     def get_x(self):
         """Return the x coordinate of the cursor.
 
@@ -132,4 +161,183 @@ class Cursor:
         :return: Tuple with x and y coordinates of cursor.
         :rtype: tuple
         """
-        return (self.x, self.y)
+        return (self._x, self._y)
+
+
+class CursorSet(MutableSequence):
+    """A list of cursors indexed by position.
+
+    The cursors are kept in the order they were added so that the first one
+    is the main cursor. Cursors notify the set when they move, which keeps the
+    amount of cursors at each (x, y) position and the cursors on each line up
+    to date. This makes checking if a position has a cursor and getting the
+    cursors on a line independent of the total amount of cursors.
+
+    Moving cursors below a line on the y axis is done in bulk, after which the
+    index is rebuilt when it's needed next.
+    """
+
+    def __init__(self, cursors=None):
+        self.cursors = []
+        # Amount of cursors by (x, y) position, None when it needs to be rebuilt
+        self.positions = {}
+        # Cursors by line number stored in dicts by id, None when it needs to be rebuilt
+        self.rows = {}
+        # Cursors sorted by position, None when it needs to be updated
+        self._sorted = None
+        if cursors is not None:
+            self.extend(cursors)
+
+    def _index(self):
+        """Rebuild the position index if it's outdated."""
+        if self.rows is not None:
+            return
+        self.positions = {}
+        self.rows = {}
+        for cursor in self.cursors:
+            self._index_cursor(cursor)
+
+    def _index_cursor(self, cursor):
+        pos = (cursor._x, cursor._y)
+        self.positions[pos] = self.positions.get(pos, 0) + 1
+        self.rows.setdefault(cursor._y, {})[id(cursor)] = cursor
+
+    def _add(self, cursor):
+        """Take ownership of a cursor and index it."""
+        if not isinstance(cursor, Cursor):
+            cursor = Cursor(cursor)
+        cursor._owner = self
+        if self.rows is not None:
+            self._index_cursor(cursor)
+        self._sorted = None
+        return cursor
+
+    def _remove(self, cursor, x, y):
+        """Remove the index entries of a cursor that was at (x, y)."""
+        self._sorted = None
+        if self.rows is None:
+            return
+        pos = (x, y)
+        count = self.positions[pos] - 1
+        if count:
+            self.positions[pos] = count
+        else:
+            del self.positions[pos]
+        row = self.rows[y]
+        del row[id(cursor)]
+        if not row:
+            del self.rows[y]
+
+    def cursor_moved(self, cursor, x, y):
+        """Called by cursors when they move from (x, y)."""
+        self._remove(cursor, x, y)
+        self._add(cursor)
+
+    def __len__(self):
+        return len(self.cursors)
+
+    def __getitem__(self, i):
+        return self.cursors[i]
+
+    def _discard(self, i):
+        """Remove the cursors at index or slice i from the index."""
+        cursors = self.cursors[i]
+        if not isinstance(i, slice):
+            cursors = [cursors]
+        for cursor in cursors:
+            self._remove(cursor, cursor._x, cursor._y)
+            cursor._owner = None
+
+    def __setitem__(self, i, cursor):
+        self._discard(i)
+        if isinstance(i, slice):
+            self.cursors[i] = [self._add(c) for c in cursor]
+        else:
+            self.cursors[i] = self._add(cursor)
+
+    def __delitem__(self, i):
+        self._discard(i)
+        del self.cursors[i]
+
+    def __iter__(self):
+        return iter(self.cursors)
+
+    def __contains__(self, cursor):
+        """Check if there is a cursor at the position of a Cursor or (x, y) tuple."""
+        self._index()
+        if isinstance(cursor, Cursor):
+            return (cursor._x, cursor._y) in self.positions
+        return tuple(cursor) in self.positions
+
+    def insert(self, i, cursor):
+        self.cursors.insert(i, self._add(cursor))
+
+    def append(self, cursor):
+        self.cursors.append(self._add(cursor))
+
+    def on_line(self, line_no):
+        """Return the cursors on a line."""
+        self._index()
+        row = self.rows.get(line_no)
+        if not row:
+            return []
+        return list(row.values())
+
+    def line_numbers(self):
+        """Return the sorted line numbers that have cursors."""
+        self._index()
+        return sorted(self.rows)
+
+    def sorted(self):
+        """Return the cursors sorted by their position."""
+        if self._sorted is None:
+            self._sorted = sorted(self.cursors, key=lambda c: (c._y, c._x))
+        return list(self._sorted)
+
+    def first(self):
+        """Return the topmost cursor."""
+        if self._sorted is None:
+            self.sorted()
+        return self._sorted[0] if self._sorted else None
+
+    def last(self):
+        """Return the bottommost cursor."""
+        if self._sorted is None:
+            self.sorted()
+        return self._sorted[-1] if self._sorted else None
+
+    def shift_x(self, line_no, col, delta):
+        """Move cursors on a line that are after col with delta on the x axis."""
+        for cursor in self.on_line(line_no):
+            if cursor.x > col:
+                cursor.move_right(delta)
+
+    def shift_y(self, line_no, delta, exclude=None):
+        """Move cursors below a line with delta on the y axis."""
+        moved = False
+        for cursor in self.cursors:
+            if cursor._y > line_no and cursor is not exclude:
+                cursor._y += delta
+                moved = True
+        if moved:
+            self.rows = self.positions = None
+            if delta < 0 or exclude is not None:
+                # Moving down keeps the cursors in the same order
+                self._sorted = None
+
+    def purge(self):
+        """Remove cursors that have the same position as an earlier cursor."""
+        self._index()
+        if len(self.positions) == len(self.cursors):
+            return
+        cursors = []
+        found = set()
+        for cursor in self.cursors:
+            pos = (cursor._x, cursor._y)
+            if pos in found:
+                self._remove(cursor, pos[0], pos[1])
+                cursor._owner = None
+                continue
+            found.add(pos)
+            cursors.append(cursor)
+        self.cursors = cursors
@@ -4,39 +4,75 @@ Editor class for extending viewer with text editing features.
 """
 
 
+import bisect
+
 from . import helpers
 
 from .line import Line
 from .cursor import Cursor
 from .viewer import Viewer
-
-
-class State:
-    """Store editor state for undo/redo."""
-    def __init__(self, editor=None):
-        self.cursors = [Cursor()]
-        self.lines = [Line()]
-        self.y_scroll = 0
-        self.x_scroll = 0
-        self.last_find = ""
-        if editor is not None:
-            self.store(editor)
-
-    def store(self, editor):
-        """Store the state of editor instance."""
-        self.cursors = [cursor.tuple() for cursor in editor.cursors]
-        self.lines = [line.data for line in editor.lines]
-        self.y_scroll = editor.y_scroll
-        self.x_scroll = editor.x_scroll
-        self.last_find = editor.last_find
-
-    def restore(self, editor):
-        """Restore stored state into the editor instance."""
-        editor.cursors = [Cursor(cursor) for cursor in self.cursors]
-        editor.lines = [Line(line) for line in self.lines]
-        editor.y_scroll = self.y_scroll
-        editor.x_scroll = self.x_scroll
-        editor.last_find = self.last_find
+from .buffer import ChangeTracker, ChunkedLineBuffer
+
+
+class State(object):
+    """Store an undoable change to the editor for undo/redo.
+
+    Only the changed line ranges are stored, along with the cursors, scroll
+    position and last search from before and after the change.
+    """
+    def __init__(self, action=None, before=None):
+        self.action = action
+        # List of (start, old_lines, new_lines) tuples in the order they were made
+        self.changes = []
+        self.before = before
+        self.after = before
+        # Rough estimate of the memory used by the state in bytes
+        self.size = 0
+        # Part of the size estimate used by the cursors after the change
+        self.view_size = 0
+        # Generation of the editor contents after the change
+        self.generation = 0
+
+    def add_change(self, start, old, new):
+        """Add a change that replaced the lines old with new at index start."""
+        if self.changes:
+            prev_start, prev_old, prev_new = self.changes[-1]
+            # Merge with the previous change if it touched the same lines
+            if prev_start == start and len(prev_new) == len(old):
+                self.size -= self._change_size(prev_old, prev_new)
+                self.changes[-1] = (start, prev_old, new)
+                self.size += self._change_size(prev_old, new)
+                return
+        self.changes.append((start, old, new))
+        self.size += self._change_size(old, new)
+
+    def _change_size(self, old, new):
+        size = 64 * (len(old) + len(new))
+        for line in old:
+            size += len(line)
+        for line in new:
+            size += len(line)
+        return size
+
+    def set_after(self, view_state):
+        """Set the cursor and scroll state after the change."""
+        self.after = view_state
+        # Replace the estimate of the previous view state when merging changes
+        self.size -= self.view_size
+        self.view_size = 64 * len(view_state[0])
+        self.size += self.view_size
+
+    def undo(self, editor):
+        """Revert the change in the editor instance."""
+        for start, old, new in reversed(self.changes):
+            editor.lines[start:start+len(new)] = old
+        editor.set_view_state(self.before)
+
+    def redo(self, editor):
+        """Reapply the change in the editor instance."""
+        for start, old, new in self.changes:
+            editor.lines[start:start+len(old)] = new
+        editor.set_view_state(self.after)
 
 
 class Editor(Viewer):
@@ -50,12 +86,37 @@ class Editor(Viewer):
         """
         Viewer.__init__(self, app, window)
 
-        # History of editor states for undo/redo
-        self.history = [State()]
-        # Current state index of the editor
+        # History of changes for undo/redo
+        self.history = []
+        # Amount of states in history that are currently applied
         self.current_state = 0
+        # Estimated memory used by the history in bytes
+        self.history_size = 0
         # Last editor action that was used (for undo/redo)
         self.last_action = None
+        # Line contents as they were when changes were last recorded. Stored
+        # as strings in a chunked buffer so updating it is cheap on big files.
+        self.undo_snapshot = ChunkedLineBuffer([""])
+        # Cursor and scroll state when changes were last recorded
+        self.view_state = self.get_view_state()
+        # Tracks which lines change between recording states
+        self.undo_tracker = ChangeTracker()
+        self.lines.add_tracker(self.undo_tracker)
+        # Changes taken from the tracker with collect_changes that aren't recorded yet
+        self.collected_changes = []
+        # Generation of the current contents. Incremented when changes are
+        # recorded and restored by undo/redo.
+        self.generation = 0
+        # Last generation number that was used
+        self.max_generation = 0
+        # Generation of the contents before the first state in history
+        self.base_generation = 0
+        # Generation of the contents when they were last saved
+        self.saved_generation = 0
+        # Whether the file is being loaded in the background. Editing is
+        # disabled until it's loaded so that the crash recovery journal
+        # starts from the contents on disk.
+        self.loading = False
 
     def init(self):
         Viewer.init(self)
@@ -88,6 +149,9 @@ class Editor(Viewer):
         }
         for key in operations.keys():
             self.operations[key] = operations[key]
+        # Operations that modify the contents
+        self.edit_operations = ["backspace", "delete", "insert", "enter", "tab", "untab", "push_up", "push_down",
+                                "undo", "redo", "cut", "duplicate_line"]
 
     def set_buffer(self, buffer):
         """Sets local or global buffer depending on config."""
@@ -99,61 +163,215 @@ class Editor(Viewer):
     def set_data(self, data):
         """Set the editor text contents."""
         Viewer.set_data(self, data)
-        buffer = self.get_buffer()  # TODO: check this
-        if len(buffer) > 1:
+        if self.history:
+            # Replacing existing contents can be undone
             self.store_state()
         else:
-            state = State()
-            state.store(self)
-            self.history[0] = state
+            # Initial contents are the starting point for undo
+            self.undo_tracker.reset()
+            self.collected_changes = []
+            self.undo_snapshot = ChunkedLineBuffer(self.lines.iter_data())
+            self.view_state = self.get_view_state()
+
+    def set_mapped_data(self, path, encoding="utf-8"):
+        """View a file read only. Editing operations are disabled and history is cleared."""
+        Viewer.set_mapped_data(self, path, encoding)
+        self.history = []
+        self.current_state = 0
+        self.history_size = 0
+        self.undo_tracker.reset()
+        self.collected_changes = []
+        self.undo_snapshot = ChunkedLineBuffer()
+        self.view_state = self.get_view_state()
+
+    def append_lines(self, lines):
+        """Append lines to the end of the contents without recording an undo state.
+
+        :param list lines: Lines to append as strings.
+        """
+        self.record_pending_changes()
+        Viewer.append_lines(self, lines)
+        # The appended lines are part of the starting point for undo
+        self.undo_tracker.reset()
+        self.undo_snapshot.extend(lines)
+
+    def set_line_data(self, index, data):
+        """Replace the data of a line without recording an undo state.
+
+        :param int index: Index of the line.
+        :param str data: New data of the line.
+        """
+        self.record_pending_changes()
+        self.lines[index].set_data(data)
+        # The new data is part of the starting point for undo
+        self.undo_tracker.reset()
+        self.undo_snapshot[index] = data
+
+    def get_view_state(self):
+        """Return the cursors, scroll position and last search as a tuple."""
+        cursors = [cursor.tuple() for cursor in self.cursors]
+        return (cursors, self.y_scroll, self.x_scroll, self.last_find)
+
+    def set_view_state(self, view_state):
+        """Restore cursors, scroll position and last search from a tuple."""
+        cursors, self.y_scroll, self.x_scroll, self.last_find = view_state
+        self.cursors = [Cursor(cursor) for cursor in cursors]
+
+    def get_changes(self):
+        """Return lines changed since the last call as a (start, old_lines, new_lines) tuple.
+
+        Returns None if nothing changed.
+        """
+        changed = self.undo_tracker.take()
+        if changed is None:
+            return None
+        start, old_end, new_end = changed
+        old = list(self.undo_snapshot.iter_data(start, old_end))
+        new = list(self.lines.iter_data(start, new_end))
+        self.undo_snapshot[start:old_end] = new
+        # Strip unchanged lines from both ends of the range
+        head = 0
+        while head < len(old) and head < len(new) and old[head] == new[head]:
+            head += 1
+        tail = 0
+        while tail < len(old)-head and tail < len(new)-head and old[-tail-1] == new[-tail-1]:
+            tail += 1
+        if head == len(old) == len(new):
+            return None
+        return start+head, old[head:len(old)-tail], new[head:len(new)-tail]
+
+    def collect_changes(self):
+        """Take the lines changed so far as a separate change of the next recorded state.
+
+        Used when an operation changes lines far apart from each other, so
+        the lines between them don't end up in the history.
+        """
+        change = self.get_changes()
+        if change is not None:
+            self.collected_changes.append(change)
+
+    def has_pending_changes(self):
+        """Check if there are changes that haven't been recorded in the history."""
+        return bool(self.collected_changes) or self.undo_tracker.has_changes()
 
     def store_action_state(self, action, state=None):
-        """Store the editor state if a new action is taken."""
+        """Store the editor state if a new action is taken.
+
+        Consecutive changes made with the same action are merged into one undo state.
+        """
         if self.last_action != action:
             self.last_action = action
-            self.store_state(state)
+            self.store_state(state, action)
         else:
-            # FIXME: This if is here just for safety.
-            # FIXME: current_state might be wrong ;.<
-            if self.current_state < len(self.history)-1:
-                self.history[self.current_state].store(self)
+            self.record_changes(action, merge=True)
 
     def store_state(self, state=None, action=None):
         """Store the current editor state for undo/redo."""
-        if state is None:
-            state = State()
-            state.store(self)
-        if len(self.history) > 1:
-            if self.current_state < len(self.history)-1:
-                self.history = self.history[:self.current_state]
+        self.record_changes(action)
 
-        self.history.append(state)
-        self.current_state = len(self.history)-1
-
-        if len(self.history) > self.config["max_history"]:
-            self.history.pop(0)
+    def record_changes(self, action=None, merge=False):
+        """Record changes made since the last call in the undo history."""
+        if self.read_only:
+            return False
+        self.collect_changes()
+        changes = self.collected_changes
+        self.collected_changes = []
+        view_state = self.get_view_state()
+        if not changes and view_state == self.view_state:
+            return False
+        if merge and self.current_state and self.current_state == len(self.history):
+            state = self.history[-1]
+            self.history_size -= state.size
+        else:
+            # Discard states that were undone
+            for state in self.history[self.current_state:]:
+                self.history_size -= state.size
+            self.history = self.history[:self.current_state]
+            state = State(action, self.view_state)
+            self.history.append(state)
+            self.current_state += 1
+        if changes:
+            for change in changes:
+                state.add_change(*change)
+            self.max_generation += 1
+            self.generation = self.max_generation
+        state.generation = self.generation
+        state.set_after(view_state)
+        self.history_size += state.size
+        self.view_state = view_state
+        self.limit_history()
+        return True
+
+    def mark_saved(self, generation=None):
+        """Mark the current contents as saved.
+
+        :param int generation: Mark the contents of an earlier generation as saved instead.
+        """
+        self.record_pending_changes()
+        if generation is None:
+            generation = self.generation
+        self.saved_generation = generation
+
+    def is_modified(self):
+        """Check if the contents have changed since they were marked as saved."""
+        if self.read_only:
+            # Read only buffers only change when more of the file is indexed
+            return False
+        return self.has_pending_changes() or self.generation != self.saved_generation
+
+    def record_pending_changes(self):
+        """Record changes that were made without storing an undo state."""
+        if self.has_pending_changes():
+            self.record_changes()
+
+    def limit_history(self):
+        """Remove the oldest states if the history is too long or uses too much memory."""
+        max_size = self.config.get("max_history_memory", 0) * 1024 * 1024
+        while len(self.history) > 1 and self.current_state > 1:
+            if len(self.history) <= self.config["max_history"]:
+                if not max_size or self.history_size <= max_size:
+                    break
+            state = self.history.pop(0)
+            self.history_size -= state.size
+            self.base_generation = state.generation
+            self.current_state -= 1
 
     def restore_state(self, index=None):
-        """Restore an editor state."""
-        if len(self.history) <= 1:
-            return False
+        """Undo or redo states until index states in the history are applied."""
         if index is None:
             index = self.current_state-1
-
-        if index < 0 or index >= len(self.history):
+        if index < 0 or index > len(self.history):
             return False
-
-        # if self.current_state < len(self.history):
-        #     self.current_state = self.current_state-1
-
-        state = self.history[index]
-        state.restore(self)
-        self.current_state = index
+        while self.current_state > index:
+            self.current_state -= 1
+            self.history[self.current_state].undo(self)
+        while self.current_state < index:
+            self.history[self.current_state].redo(self)
+            self.current_state += 1
+        if self.current_state:
+            self.generation = self.history[self.current_state-1].generation
+        else:
+            self.generation = self.base_generation
+        # Keep the snapshot in sync with the restored lines
+        self.get_changes()
+        self.collected_changes = []
+        self.view_state = self.get_view_state()
+        self.move_cursors()
+        return True
 
     def handle_input(self, event):
+        # Remember where the cursors were before any changes
+        if not self.has_pending_changes():
+            self.view_state = self.get_view_state()
+        if event.type == "paste":
+            if self.is_editable():
+                self.insert_text(event.text)
+            return True
         done = Viewer.handle_input(self, event)
-        if not done:
+        if not done and not self.read_only:
             if event.is_typeable:
+                if not self.is_editable():
+                    return True
                 if isinstance(event.key_code, str):
                     self.type(event.key_code)
                 elif event.key_name:
@@ -161,15 +379,33 @@ class Editor(Viewer):
                 return True
         return False
 
+    def run_operation(self, operation):
+        """Run an editor core operation. Editing operations are ignored in read only mode."""
+        if operation in self.edit_operations and not self.is_editable():
+            return False
+        return Viewer.run_operation(self, operation)
+
+    def is_editable(self):
+        """Check if the contents can be edited. If not the reason is shown in the status bar."""
+        if self.read_only:
+            self.app.set_status("File is read only")
+            return False
+        if self.loading:
+            self.app.set_status("Can't edit the file while it's loading")
+            return False
+        return True
+
     def undo(self):
         """Undo the last command or change."""
         self.last_action = "undo"
+        self.record_pending_changes()
         self.restore_state()
 
     def redo(self):
         """Redo the last command or change."""
         self.last_action = "redo"
-        if self.current_state == len(self.history)-1:
+        self.record_pending_changes()
+        if self.current_state >= len(self.history):
             return False
         index = self.current_state+1
         self.restore_state(index)
@@ -254,36 +490,76 @@ class Editor(Viewer):
 
     def delete(self):
         """Delete the next character."""
-        for cursor in self.cursors:
-            if len(self.lines)-1 < cursor.y:
+        # Cursors at the same position are edited only once
+        self.purge_cursors()
+        edits = {}
+        joins = set()
+        last = len(self.lines) - 1
+        for line_no in self.get_lines_with_cursors():
+            if line_no > last:
                 # If we've run out of lines
                 break
-            line = self.lines[cursor.y]
-            # if we have more than 1 line
-            # and we're at the end of the current line
-            # and we're not on the last line
-            if len(self.lines) > 1 and cursor.x == len(line) and cursor.y != len(self.lines) - 1:
-                data = self.lines[cursor.y].get_data()
-                self.lines.pop(cursor.y)
-                self.lines[cursor.y].set_data(data+self.lines[cursor.y])
-                # Reposition cursors from line below into correct positions on current line
-                line_cursors = self.get_cursors_on_line(cursor.y+1)
-                for c in line_cursors:
-                    c.move_right(len(data))
-                    c.move_up()
-                self.move_y_cursors(cursor.y, -1)
-            else:
-                start = line[:cursor.x]
-                end = line[cursor.x+1:]
-                self.lines[cursor.y].set_data(start+end)
-                self.move_x_cursors(cursor.y, cursor.x, -1)
+            length = len(self.lines[line_no])
+            for x in sorted(cursor.x for cursor in self.get_cursors_on_line(line_no)):
+                # Join the next line if we're at the end of a line that isn't the last one
+                if x == length and line_no != last:
+                    joins.add(line_no)
+                elif x < length:
+                    edits.setdefault(line_no, []).append((x, x+1, ""))
+        self.edit_lines(edits)
+        self.join_lines(joins)
         self.move_cursors()
         # Add a restore point if previous action != delete
         self.store_action_state("delete")
 
     def backspace(self):
         """Delete the previous character."""
-        curs = reversed(sorted(self.cursors, key=lambda c: (c[1], c[0])))
+        # Cursors at the same position are edited only once
+        self.purge_cursors()
+        edits = {}
+        joins = set()
+        for line_no in self.get_lines_with_cursors():
+            curr_line = self.lines[line_no]
+            line_edits = []
+            for x in sorted(cursor.x for cursor in self.get_cursors_on_line(line_no)):
+                if x == 0:
+                    # At the beginning of a line join it with the previous one
+                    if line_no != 0:
+                        joins.add(line_no-1)
+                    continue
+                start = x - self.get_backspace_width(curr_line, x)
+                if line_edits and start < line_edits[-1][1]:
+                    # Unindenting overlaps with another cursor so handle cursors one by one
+                    return self.backspace_cursors()
+                line_edits.append((start, x, ""))
+            if line_edits:
+                edits[line_no] = line_edits
+        self.edit_lines(edits)
+        self.join_lines(joins)
+        # Ensure we keep the view scrolled
+        self.move_cursors()
+        self.scroll_up()
+        # Add a restore point if previous action != backspace
+        self.store_action_state("backspace")
+
+    def get_backspace_width(self, line, x):
+        """Return the amount of characters to remove when backspacing at x on a line."""
+        # Check if we should unindent
+        if self.config["backspace_unindent"]:
+            # Check if we can unindent, and that it's actually whitespace
+            # We don't do this for hard tabs since they're just a single character
+            if not self.config["hard_tabs"]:
+                indent = self.config["tab_width"]
+                if x >= indent:
+                    if line[x-indent:x] == indent*" ":
+                        # Remove an indents worth of whitespace
+                        return indent
+        # Remove one character by default
+        return 1
+
+    def backspace_cursors(self):
+        """Delete the previous character at each cursor, one cursor at a time."""
+        curs = reversed(self.cursors.sorted())
         # Iterate through all cursors from bottom to top
         for cursor in curs:
             line_no = cursor.y
@@ -314,18 +590,7 @@ class Editor(Viewer):
             # Handle all other cases
             else:
                 curr_line = self.lines[line_no]
-                # Remove one character by default
-                del_n_chars = 1
-                # Check if we should unindent
-                if self.config["backspace_unindent"]:
-                    # Check if we can unindent, and that it's actually whitespace
-                    # We don't do this for hard tabs since they're just a single character
-                    if not self.config["hard_tabs"]:
-                        indent = self.config["tab_width"]
-                        if cursor.x >= indent:
-                            if curr_line[cursor.x-indent:cursor.x] == indent*" ":
-                                # Remove an indents worth of whitespace
-                                del_n_chars = indent
+                del_n_chars = self.get_backspace_width(curr_line, cursor.x)
                 # Slice characters out of the line
                 start = curr_line[:cursor.x-del_n_chars]
                 end = curr_line[cursor.x:]
@@ -341,12 +606,83 @@ class Editor(Viewer):
         # Add a restore point if previous action != backspace
         self.store_action_state("backspace")
 
+    def edit_lines(self, edits):
+        """Replace parts of lines and move the cursors on them accordingly.
+
+        All edits on a line are applied at once. Cursors after an edit are
+        moved by the change in length, and cursors at the end of an edit
+        are moved to the end of the replacement.
+
+        :param dict edits: Lists of (start, end, text) tuples by line number. The edits on a line
+            must be sorted and not overlap.
+        """
+        for line_no, line_edits in edits.items():
+            line = self.lines[line_no]
+            data = line.get_data()
+            parts = []
+            pos = 0
+            for start, end, text in line_edits:
+                parts.append(data[pos:start])
+                parts.append(text)
+                pos = end
+            parts.append(data[pos:])
+            line.set_data("".join(parts))
+
+            # Move the cursors in a single pass over both sorted lists
+            i = 0
+            delta = 0
+            for cursor in sorted(self.get_cursors_on_line(line_no), key=lambda c: c.x):
+                while i < len(line_edits) and line_edits[i][1] <= cursor.x:
+                    start, end, text = line_edits[i]
+                    delta += len(text) - (end - start)
+                    i += 1
+                if delta:
+                    cursor.set_x(cursor.x + delta)
+
+    def join_lines(self, joins):
+        """Join lines with the lines after them and move the cursors on them accordingly.
+
+        Each run of consecutive joined lines is recorded as a separate change,
+        so the lines between the joins aren't stored in the undo history.
+
+        :param set joins: Line numbers of the lines to join with the next line.
+        """
+        if not joins:
+            return
+        joins = sorted(joins)
+        # Line number of the line each joined line is joined to and its x offset in it
+        positions = {}
+        # Join runs of consecutive lines from last to first so that line numbers before them stay valid
+        i = len(joins)
+        while i > 0:
+            j = i - 1
+            while j > 0 and joins[j-1] == joins[j] - 1:
+                j -= 1
+            first = joins[j]
+            end = joins[i-1] + 2
+            parts = list(self.lines.iter_data(first, end))
+            length = len(parts[0])
+            for line_no, data in enumerate(parts[1:], first + 1):
+                positions[line_no] = (first, length)
+                length += len(data)
+            self.lines[first].set_data("".join(parts))
+            del self.lines[first+1:end]
+            self.collect_changes()
+            i = j
+
+        for cursor in self.cursors:
+            if cursor.y in positions:
+                cursor.y, offset = positions[cursor.y]
+                cursor.move_right(offset)
+            # Move up by the amount of lines that were removed before the line
+            cursor.y -= bisect.bisect_left(joins, cursor.y)
+
     def enter(self):
         """Insert a new line at each cursor."""
         # We sort the cursors, and loop through them from last to first
         # That way we avoid messing with
         # the relative positions of the higher cursors
-        curs = sorted(self.cursors, key=lambda c: (c[1], c[0]))
+        curs = self.cursors.sorted()
         curs = reversed(curs)
         for cursor in curs:
             # The current line this cursor is on
@@ -384,7 +720,7 @@ class Editor(Viewer):
             # the buffer until it's at least as long as the cursor count
             while len(buffer) < len(self.cursors):
                 buffer.extend(buffer)
-            curs = sorted(self.cursors, key=lambda c: (c[1], c[0]))
+            curs = self.cursors.sorted()
             for cursor in curs:
                 line = self.lines[cursor.y]
                 buf = buffer[0]
@@ -406,15 +742,13 @@ class Editor(Viewer):
         self.store_action_state("insert")
 
     def insert_lines_at(self, lines, at):
-        rev_lines = reversed(lines)
-        for line in rev_lines:
-            self.lines.insert(at, Line(line))
+        self.lines.insert_lines(at, [Line(line) for line in lines])
         self.move_y_cursors(at, len(lines))
 
     def push_up(self):
         """Move current lines up by one line."""
         used_y = []
-        curs = sorted(self.cursors, key=lambda c: (c[1], c[0]))
+        curs = self.cursors.sorted()
         for cursor in curs:
             if cursor.y in used_y:
                 continue
@@ -432,7 +766,7 @@ class Editor(Viewer):
     def push_down(self):
         """Move current lines down by one line."""
         used_y = []
-        curs = reversed(sorted(self.cursors, key=lambda c: (c[1], c[0])))
+        curs = reversed(self.cursors.sorted())
         for cursor in curs:
             if cursor.y in used_y:
                 continue
@@ -522,12 +856,67 @@ class Editor(Viewer):
 
     def type(self, data):
         """Insert data at each cursor position."""
-        for cursor in self.cursors:
-            self.type_at_cursor(cursor, data)
+        # Cursors at the same position are edited only once
+        self.purge_cursors()
+        edits = {}
+        for line_no in self.get_lines_with_cursors():
+            xs = sorted(cursor.x for cursor in self.get_cursors_on_line(line_no))
+            edits[line_no] = [(x, x, data) for x in xs]
+        self.edit_lines(edits)
         self.move_cursors()
         # Add a restore point if previous action != type
         self.store_action_state("type")
 
+    def insert_text(self, data):
+        """Insert text that can span several lines at each cursor position.
+
+        Used for pasting text all at once instead of typing it one key at a
+        time. The whole insertion is stored as a single undo state.
+
+        :param str data: Text to insert.
+        """
+        data = data.replace("\r\n", "\n").replace("\r", "\n")
+        if not self.config["hard_tabs"]:
+            data = data.replace("\t", " " * self.config["tab_width"])
+        parts = data.split("\n")
+        self.purge_cursors()
+        # Group the cursors by line before any of them are moved
+        rows = [(line_no, sorted(self.get_cursors_on_line(line_no), key=lambda c: c.x))
+                for line_no in self.get_lines_with_cursors()]
+        # Amount of lines inserted above the current line
+        offset = 0
+        for line_no, cursors in rows:
+            y = line_no + offset
+            line = self.lines[y]
+            line_data = line.get_data()
+            new_lines = []
+            current = ""
+            pos = 0
+            positions = []
+            for cursor in cursors:
+                x = min(cursor.x, len(line_data))
+                current += line_data[pos:x] + parts[0]
+                for part in parts[1:]:
+                    new_lines.append(current)
+                    current = part
+                positions.append((cursor, len(current), y + len(new_lines)))
+                pos = x
+            tail = current + line_data[pos:]
+            if new_lines:
+                line.set_data(new_lines[0])
+                self.lines.insert_lines(y + 1, [Line(text) for text in new_lines[1:] + [tail]])
+                offset += len(new_lines)
+            else:
+                line.set_data(tail)
+            for cursor, x, cursor_y in positions:
+                cursor.set_y(cursor_y)
+                cursor.set_x(x)
+        self.move_cursors()
+        self.scroll_down()
+        # Each insertion is undone separately
+        self.last_action = "insert_text"
+        self.store_state(action="insert_text")
+
     def type_at_cursor(self, cursor, data):
         """Insert data at specified cursor."""
         line = self.lines[cursor.y]
@@ -556,7 +945,7 @@ class Editor(Viewer):
 
     def duplicate_line(self):
         """Copy current line and add it below as a new line."""
-        curs = sorted(self.cursors, key=lambda c: (c.y, c.x))
+        curs = self.cursors.sorted()
         for cursor in curs:
             line = Line(self.lines[cursor.y])
             self.lines.insert(cursor.y+1, line)
@@ -3,26 +3,330 @@
 File object for storing an opened file and editor.
 """
 
+import io
 import os
+import errno
+import stat
 import time
+import tempfile
+import codecs
+import hashlib
 import logging
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 from .helpers import parse_path
+from .journal import EditJournal
+from .watcher import get_state, hash_file
+
+
+class FileLoader(object):
+    """Reads a file in chunks on a worker thread.
+
+    The worker decodes the file and splits it into lines. Results are put in
+    a queue as (kind, value) tuples and applied in the main thread:
+    ("lines", list_of_complete_lines), ("done", (last_line, digest)) when
+    finished or ("data", (text, encoding, digest)) if the file had to be
+    decoded again as a whole. The digest is the hash of the file contents.
+    """
+
+    chunk_size = 1024 * 1024
+
+    def __init__(self, file, path, encoding):
+        self.file = file
+        self.path = path
+        self.encoding = encoding
+        self.size = os.path.getsize(path)
+        # Amount of bytes read so far, updated by the worker
+        self.bytes_read = 0
+        self.cancelled = False
+        self.queue = queue.Queue(maxsize=16)
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def cancel(self):
+        """Stop reading the file."""
+        self.cancelled = True
+
+    def get_progress(self):
+        """Return the fraction of the file that has been read."""
+        if not self.size:
+            return 1.0
+        return min(1.0, float(self.bytes_read) / self.size)
+
+    def get_result(self):
+        """Return the next available result or None."""
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            return None
+
+    def _put(self, item):
+        while not self.cancelled:
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _run(self):
+        start = time.time()
+        decoder = codecs.getincrementaldecoder(self.encoding)()
+        # Translates \r\n and \r to \n like files opened in text mode
+        newlines = io.IncrementalNewlineDecoder(decoder, translate=True)
+        partial = ""
+        last_char = ""
+        digest = hashlib.sha1()
+        try:
+            with open(self.path, "rb") as f:
+                while not self.cancelled:
+                    chunk = f.read(self.chunk_size)
+                    final = not chunk
+                    digest.update(chunk)
+                    text = partial + newlines.decode(chunk, final=final)
+                    self.bytes_read += len(chunk)
+                    lines = text.splitlines()
+                    partial = ""
+                    if text:
+                        last_char = text[-1]
+                        if last_char.splitlines() != [""]:
+                            # The last line continues in the next chunk
+                            partial = lines.pop()
+                    if lines:
+                        self._put(("lines", lines))
+                    if final:
+                        # Like set_data, add an empty line if the file ends with a line break
+                        if last_char in ("", "\n"):
+                            partial = ""
+                        elif not partial:
+                            partial = None
+                        self.file.logger.info("Decoded '{0}' as {1} in {2:.3f}s.".format(
+                            self.path, self.encoding, time.time() - start))
+                        self._put(("done", (partial, digest.hexdigest())))
+                        return
+        except UnicodeDecodeError:
+            self.file.logger.warning("Decoding '{0}' as {1} failed.".format(self.path, self.encoding))
+            self._put(("data", self.file._read(self.path)))
+        except:
+            self.file.logger.exception("Failed reading file '{file}'".format(file=self.path))
+            self._put(("data", (False, None, None)))
+
+
+class FileSaver(object):
+    """Writes lines to a file on a worker thread.
+
+    The lines are written in chunks to a temporary file next to the target,
+    which is synced to disk and then renamed over the target. That way the
+    target is never left partially written. New files and files in
+    directories that can't be written to are written directly instead. The
+    result is put in a queue as ("done", digest) or ("error", None), where
+    digest is the hash of the written bytes. If a character can't be encoded
+    the result is ("encoding_error", (line, column)) with the position of the
+    character, and nothing is written.
+    """
+
+    chunk_lines = 4096
+
+    def __init__(self, file, path, lines, end_of_line, encoding):
+        self.file = file
+        # Write through symlinks instead of replacing them
+        self.path = os.path.realpath(path)
+        self.lines = lines
+        self.end_of_line = end_of_line
+        self.encoding = encoding
+        # Amount of lines written so far, updated by the worker
+        self.lines_written = 0
+        # Position of a character that couldn't be encoded
+        self.error_position = None
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run)
+        # Let the save finish even if the app exits
+        self.thread.daemon = False
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        """Write the file in the current thread and return the result."""
+        self._run()
+        return self.get_result()
+
+    def get_progress(self):
+        """Return the fraction of the lines that have been written."""
+        if not self.lines:
+            return 1.0
+        return min(1.0, float(self.lines_written) / len(self.lines))
+
+    def get_result(self):
+        """Return the result or None if the file isn't written yet."""
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            return None
+
+    def _run(self):
+        try:
+            result = self._write()
+        except UnicodeEncodeError:
+            line, column = self.error_position
+            self.file.logger.warning("Can't encode line {0} column {1} of '{2}' as {3}.".format(
+                line + 1, column + 1, self.path, self.encoding))
+            self.queue.put(("encoding_error", self.error_position))
+            return
+        except:
+            self.file.logger.exception("Failed writing file '{file}'".format(file=self.path))
+            self.queue.put(("error", None))
+            return
+        self.queue.put(("done", result))
+
+    def _write(self):
+        """Write the file atomically if possible and return the hash of the written data.
+
+        The file is written to a temporary file that then replaces it. Files
+        with other hard links, or whose owner or extended attributes can't be
+        given to the temporary file, are written in place instead.
+        """
+        if not os.path.isfile(self.path):
+            try:
+                return self._write_to(self.path)
+            except UnicodeEncodeError:
+                # Don't leave a partially written new file behind
+                os.remove(self.path)
+                raise
+        info = os.stat(self.path)
+        if info.st_nlink > 1:
+            # Replacing the file would separate it from its other links
+            return self._write_in_place()
+        directory, name = os.path.split(self.path)
+        try:
+            fd, temp_path = tempfile.mkstemp(prefix="." + name + ".", suffix=".tmp", dir=directory)
+        except (IOError, OSError):
+            self.file.logger.warning("Can't create a temporary file, writing '{0}' in place.".format(self.path))
+            return self._write_in_place()
+        try:
+            self._copy_attributes(fd, info)
+        except (IOError, OSError):
+            os.close(fd)
+            os.remove(temp_path)
+            self.file.logger.warning("Can't keep the owner or attributes of '{0}', writing it in place.".format(
+                self.path))
+            return self._write_in_place()
+        try:
+            result = self._write_to(temp_path, fd)
+            # Set after the owner, since changing the owner can clear some mode bits
+            os.chmod(temp_path, stat.S_IMODE(info.st_mode))
+            # Replaces the target atomically (os.replace is only on Python 3)
+            getattr(os, "replace", os.rename)(temp_path, self.path)
+        except:
+            os.remove(temp_path)
+            raise
+        return result
+
+    def _write_in_place(self):
+        """Overwrite the file and return the hash of the written data."""
+        # Make sure the file can be encoded before overwriting it
+        for data in self._encode():
+            pass
+        return self._write_to(self.path)
+
+    def _copy_attributes(self, fd, info):
+        """Give the temporary file the owner, group and extended attributes of the file.
+
+        :param int fd: File descriptor of the temporary file.
+        :param info: Result of os.stat for the file.
+        :raises OSError: If they can't be copied.
+        """
+        current = os.fstat(fd)
+        if (current.st_uid, current.st_gid) != (info.st_uid, info.st_gid):
+            if not hasattr(os, "fchown"):
+                raise OSError("Can't change the owner of the temporary file")
+            os.fchown(fd, info.st_uid, info.st_gid)
+        if not hasattr(os, "listxattr"):
+            return
+        try:
+            names = os.listxattr(self.path)
+        except OSError as error:
+            if error.errno in (errno.ENOTSUP, errno.EOPNOTSUPP):
+                # The file system doesn't have extended attributes
+                return
+            raise
+        # Includes ACLs and security labels
+        for attribute in names:
+            os.setxattr(fd, attribute, os.getxattr(self.path, attribute))
+
+    def _write_to(self, path, fd=None):
+        """Write the lines in chunks to path (or fd if given) and sync it to disk."""
+        f = io.open(path if fd is None else fd, "wb")
+        digest = hashlib.sha1()
+        with f:
+            for data in self._encode():
+                f.write(data)
+                digest.update(data)
+            f.flush()
+            os.fsync(f.fileno())
+        return digest.hexdigest()
+
+    def _encode(self):
+        """Encode the lines in chunks and update lines_written.
+
+        :raises UnicodeEncodeError: If a character can't be encoded. Its
+            (line, column) position is stored in error_position.
+        """
+        encoder = codecs.getincrementalencoder(self.encoding)()
+        count = len(self.lines)
+        for start in range(0, count, self.chunk_lines):
+            end = min(start + self.chunk_lines, count)
+            text = self.end_of_line.join(self.lines[start:end])
+            if end < count:
+                text += self.end_of_line
+            try:
+                data = encoder.encode(text, end == count)
+            except UnicodeEncodeError as error:
+                line_start = text.rfind(self.end_of_line, 0, error.start) + len(self.end_of_line)
+                if line_start < len(self.end_of_line):
+                    line_start = 0
+                line = start + text.count(self.end_of_line, 0, error.start)
+                self.error_position = (line, error.start - line_start)
+                raise
+            self.lines_written = end
+            yield data
 
 
 class File:
+    # Maximum amount of bytes to detect the encoding from
+    detect_size = 1024 * 1024
+    # Amount of bytes to feed the encoding detector at a time
+    detect_chunk_size = 64 * 1024
+    # Amount of blocks to index at a time in read only files
+    index_blocks = 16
+
     def __init__(self, app=None):
         self.app = app
         self.logger = logging.getLogger(__name__)
         self.name = ""
         self.fpath = ""
-        self.data = None
-        self.read_only = False  # Currently unused
+        self.encoding = None  # Encoding the file was read with and is saved in
+        self.read_only = False  # Huge files are opened read only
         self.last_save = None  # Time of last save
         self.opened = time.time()  # Time of last open
         self.editor = None
         self.writable = True
         self.is_help = False
+        self.loader = None  # Loads the file in the background
+        self.loader_started = False  # Whether lines have been loaded in the background
+        self.saver = None  # Saves the file in the background
+        self.saver_generation = None  # Editor generation that is being saved
+        self.journal = None  # Journal of unsaved edits for crash recovery
+        self.disk_state = None  # Metadata of the file on disk when it was loaded or saved
+        self.disk_hash = None  # Hash of the file contents on disk
+        self.encoding_error = None  # Position of a character that couldn't be encoded in the last save
 
     def _path(self):
         """Get the full path of the file."""
@@ -59,14 +363,15 @@ class File:
 
     def set_path(self, path):
         """Set the file path. Relative paths are sanitized."""
+        self.unwatch()
         self.fpath, self.name = parse_path(path)
         self.update_editor_extension()
 
     def set_data(self, data):
         """Set the file data and apply to editor if it exists."""
-        self.data = data
         if self.editor:
             self.editor.set_data(data)
+            self.editor.mark_saved()
 
     def set_editor(self, editor):
         """The editor instance set its file extension."""
@@ -78,6 +383,72 @@ class File:
         self.writable = os.access(self._path(), os.W_OK)
         if not self.writable:
             self.logger.info("File not writable.")
+        if not self.read_only:
+            self.start_journal()
+
+    def start_journal(self, recover=True):
+        """Start journaling unsaved edits, optionally recovering the edits of a previous session.
+
+        :param bool recover: Replay the edits left in the journal after a crash.
+        """
+        if not self.app or not self.app.config["app"].get("journal_interval"):
+            return False
+        if not self.journal:
+            directory = os.path.join(self.app.config.config_dir, "journal")
+            self.journal = EditJournal(self._path(), directory)
+        if self.journal.load(self.editor.lines, recover):
+            # Recovered edits can be undone
+            self.editor.store_state()
+            self.app.set_status("Recovered unsaved changes to '{0}'".format(self.name))
+            return True
+        return False
+
+    def update_journal(self):
+        """Write unsaved edits to the journal periodically.
+
+        :return: True if there are edits that aren't written yet.
+        """
+        if not self.journal:
+            return False
+        return self.journal.update(self.app.config["app"]["journal_interval"])
+
+    def close_journal(self):
+        """Stop journaling and forget the unsaved edits."""
+        if self.journal:
+            self.journal.close()
+            self.journal = None
+
+    def close(self):
+        """Stop loading, journaling and watching the file."""
+        self.cancel_loading()
+        self.close_journal()
+        self.unwatch()
+
+    def _get_watcher(self):
+        if self.app:
+            return self.app.watcher
+        return None
+
+    def _set_disk_state(self, digest):
+        """Remember the state of the file on disk after loading or saving it and watch it for changes.
+
+        :param str digest: Hash of the file contents or None if it isn't known.
+        """
+        self.disk_state = get_state(self._path())
+        self.disk_hash = digest
+        self.watch()
+
+    def watch(self):
+        """Watch the file for changes made by other programs."""
+        watcher = self._get_watcher()
+        if watcher and self.disk_state:
+            watcher.watch(self._path(), self.disk_state, self.disk_hash)
+
+    def unwatch(self):
+        """Stop watching the file for changes."""
+        watcher = self._get_watcher()
+        if watcher:
+            watcher.unwatch(self._path())
 
     def update_editor_extension(self):
         """Set the editor file extension from the current file name."""
@@ -87,90 +458,330 @@ class File:
         if len(ext) >= 1:
             self.editor.set_file_extension(ext)
 
-    def save(self):
-        """Write the editor data to file."""
-        data = self.editor.get_data()
-        try:
-            f = open(self._path(), "w")
-            f.write(data)
-            f.close()
-        except:
+    def save(self, background=False):
+        """Write the editor data to file.
+
+        The file is written from a snapshot of the lines, so editing can
+        continue while large files are saved in the background.
+
+        :param bool background: Save large files in the background.
+        :return: True if the file was saved or the background save was started.
+        """
+        if self.is_loading() or self.is_saving() or self.read_only:
+            return False
+        lines = self.editor.get_lines()
+        generation = self.editor.generation
+        if self.journal:
+            self.journal.begin_save()
+        # Don't notice our own changes
+        self.unwatch()
+        saver = FileSaver(self, self._path(), lines, self.editor.config["end_of_line"], self.get_encoding())
+        if background and sum(map(len, lines)) >= self.app.config["app"]["background_save_size"]:
+            self.saver = saver
+            self.saver_generation = generation
+            saver.start()
+            self.logger.debug("Saving '{0}' in the background.".format(self.name))
+            return True
+        return self._on_saved(saver.run(), generation)
+
+    def is_saving(self):
+        """Check if the file is being saved in the background."""
+        return self.saver is not None
+
+    def get_save_progress(self):
+        """Return the fraction of the file that has been saved."""
+        if not self.saver:
+            return 1.0
+        return self.saver.get_progress()
+
+    def update_saving(self):
+        """Finish saving the file if the background save is done.
+
+        :return: None if the file is still being saved, otherwise whether it was saved.
+        """
+        if not self.saver:
+            return None
+        result = self.saver.get_result()
+        if result is None:
+            return None
+        self.saver = None
+        return self._on_saved(result, self.saver_generation)
+
+    def _on_saved(self, result, generation):
+        kind, data = result
+        if self.journal:
+            self.journal.end_save(kind == "done", self._path())
+        self.encoding_error = data if kind == "encoding_error" else None
+        if kind != "done":
+            self.watch()
             return False
-        self.data = data
+        self._set_disk_state(data)
+        # Edits made during a background save are still unsaved
+        self.editor.mark_saved(generation)
         self.last_save = time.time()
         self.writable = os.access(self._path(), os.W_OK)
+        if not self.journal:
+            self.start_journal(recover=False)
         return True
 
-    def load(self, read=True):
-        """Try to read the actual file and load the data into the editor instance."""
+    def load(self, read=True, background=False):
+        """Try to read the actual file and load the data into the editor instance.
+
+        :param bool read: Whether to actually read the file.
+        :param bool background: Read large files in the background.
+        """
         if not read:
             return True
         path = self._path()
         if not os.path.isfile(path):
             self.logger.debug("Given path isn't a file.")
             return False
-        data = self._read(path)
+        self.cancel_loading()
+        size = os.path.getsize(path)
+        large_file_size = self.app.config["app"].get("large_file_size")
+        if large_file_size and size >= large_file_size and self._load_mapped(path):
+            return True
+        self.read_only = False
+        if background and size >= self.app.config["app"]["background_load_size"]:
+            return self._load_background(path)
+        data, encoding, digest = self._read(path)
         if data is False:
             return False
-        self.data = data
+        self.encoding = encoding
         self.editor.set_data(data)
+        self.editor.mark_saved()
+        self._set_disk_state(digest)
         self.on_load()
         return True
 
-    def _read(self, path):
-        data = self._read_text(path)
-        if data is False:
-            self.logger.warning("Normal file read failed.")
-            data = self._read_binary(path)
-        if data is False:
-            self.logger.warning("Fallback file read failed.")
-            return False
-        return data
+    def get_encoding(self):
+        """Get the encoding the file was read with, or the default encoding for new files."""
+        return self.encoding or self._get_default_encoding()
 
-    def _read_text(self, file):
-        # Read text file
+    def _get_default_encoding(self):
+        """Get the encoding for files that aren't UTF-8 and for new files."""
+        encoding = "utf-8"
+        if self.app:
+            encoding = self.app.config["app"].get("default_encoding") or encoding
         try:
-            f = open(self._path())
-            data = f.read()
-            f.close()
-            return data
-        except:
-            self.logger.exception("Failed reading file \"{file}\"".format(file=file))
+            codecs.lookup(encoding)
+        except LookupError:
+            self.logger.warning("Unknown default encoding '{0}'.".format(encoding))
+            encoding = "utf-8"
+        return encoding
+
+    def _get_encodings(self, data):
+        """Generate the encodings to try decoding data with, from most to least likely.
+
+        Detecting the encoding is slow so it's only done if the others fail.
+        """
+        yield "utf-8"
+        default = self._get_default_encoding()
+        if codecs.lookup(default).name != "utf-8":
+            yield default
+        detected = self._detect_encoding(data)
+        if detected:
+            yield detected
+        # Any bytes can be decoded as Latin-1 and saved back unchanged
+        yield "latin-1"
+
+    def _detect_encoding(self, data):
+        """Detect the encoding of data from its beginning.
+
+        :return: The detected encoding or None.
+        """
+        try:
+            from chardet.universaldetector import UniversalDetector
+        except ImportError:
+            self.logger.warning("Can't detect file encoding without chardet.")
+            return None
+        start = time.time()
+        detector = UniversalDetector()
+        # Feed chunks until the detector is confident
+        for i in range(0, min(len(data), self.detect_size), self.detect_chunk_size):
+            detector.feed(data[i:i + self.detect_chunk_size])
+            if detector.done:
+                break
+        detector.close()
+        encoding = detector.result["encoding"]
+        self.logger.info("Detected encoding '{0}' in {1:.3f}s.".format(encoding, time.time() - start))
+        return encoding
+
+    def _sniff_encoding(self, path):
+        """Guess the encoding of a file from its beginning, for decoding it incrementally."""
+        try:
+            with open(path, "rb") as f:
+                data = f.read(self.detect_size)
+        except (IOError, OSError):
+            return self._get_default_encoding()
+        for encoding in self._get_encodings(data):
+            try:
+                # The sample may end in the middle of a character
+                codecs.getincrementaldecoder(encoding)().decode(data)
+                return encoding
+            except (UnicodeDecodeError, LookupError):
+                continue
+        return self._get_default_encoding()
+
+    def _load_mapped(self, path):
+        """Open a huge file for read only viewing without reading it into memory."""
+        encoding = self._sniff_encoding(path)
+        if "\n".encode(encoding) != b"\n":
+            # Line breaks can only be found in ASCII compatible encodings
+            return False
+        try:
+            self.editor.set_mapped_data(path, encoding)
+        except (IOError, OSError, ValueError):
+            self.logger.exception("Failed mapping file '{file}'".format(file=path))
             return False
+        self.read_only = True
+        self.encoding = encoding
+        self.editor.mark_saved()
+        # Huge files aren't hashed, any change to them is reported
+        self._set_disk_state(None)
+        self.on_load()
+        self.logger.debug("Opened '{0}' read only.".format(path))
+        return True
+
+    def _load_background(self, path):
+        """Start reading the file in a background thread."""
+        self.encoding = self._sniff_encoding(path)
+        self.loader = FileLoader(self, path, self.encoding)
+        self.editor.set_data("")
+        self.editor.mark_saved()
+        # Edits are accepted once the journal has been started in on_load
+        self.editor.loading = True
+        self.loader_started = False
+        self.loader.start()
+        self.logger.debug("Loading '{0}' in the background.".format(path))
+        return True
 
-    def _read_binary(self, file):
-        # Read binary file and try to autodetect encoding
+    def is_loading(self):
+        """Check if the file is being loaded or indexed in the background."""
+        return self.loader is not None or self._is_indexing()
+
+    def _is_indexing(self):
+        """Check if the lines of a read only file are still being indexed."""
+        return self.read_only and self.editor is not None and not self.editor.lines.is_indexed()
+
+    def get_load_progress(self):
+        """Return the fraction of the file that has been loaded."""
+        if self._is_indexing():
+            return self.editor.lines.get_index_progress()
+        if not self.loader:
+            return 1.0
+        return self.loader.get_progress()
+
+    def cancel_loading(self):
+        """Stop loading the file in the background."""
+        if self.loader:
+            self.loader.cancel()
+            self.loader = None
+            self.editor.loading = False
+
+    def update_loading(self, max_time=0.05):
+        """Add lines that have been read in the background to the editor.
+
+        :param float max_time: Maximum time in seconds to spend adding lines.
+        :return: True if the file is still loading.
+        """
+        end = time.time() + max_time
+        if self._is_indexing():
+            # Index the lines of read only files a few blocks at a time
+            while time.time() < end:
+                if not self.editor.lines.index_blocks(self.index_blocks):
+                    return False
+            return True
+        if not self.loader:
+            return False
+        while time.time() < end:
+            result = self.loader.get_result()
+            if result is None:
+                break
+            kind, value = result
+            if kind == "lines":
+                self._add_loaded_lines(value)
+                continue
+            # Loading is finished
+            self.loader = None
+            self.editor.loading = False
+            if kind == "done":
+                value, digest = value
+                self._set_disk_state(digest)
+                if value is not None and (self.loader_started or value):
+                    self._add_loaded_lines([value])
+            elif kind == "data":
+                value, self.encoding, digest = value
+                if value is False:
+                    self.logger.warning("Fallback file read failed.")
+                    # Don't leave a partially loaded file in the editor
+                    self.editor.set_data("")
+                    self.editor.mark_saved()
+                    self.app.set_status("Failed to load '{0}'".format(self.name))
+                    return False
+                self.editor.set_data(value)
+                self.editor.mark_saved()
+                self._set_disk_state(digest)
+            self.on_load()
+            return False
+        return True
+
+    def _add_loaded_lines(self, lines):
+        if not self.loader_started:
+            # Replace the initial empty line
+            self.editor.set_data("\n".join(lines))
+            self.editor.mark_saved()
+        else:
+            self.editor.append_lines(lines)
+        self.loader_started = True
+
+    def _read(self, path):
+        """Read a file and decode it with the first encoding that works.
+
+        :return: Tuple (text, encoding, digest) where digest is the hash of the
+            file contents, or (False, None, None) if the file couldn't be read.
+        """
+        start = time.time()
         try:
-            f = open(self._path(), "rb")
-            data = f.read()
-            f.close()
-            import chardet
-            detection = chardet.detect(data)
-            charenc = detection["encoding"]
-            if charenc is None:
-                self.logger.warning("Failed to detect file encoding.")
-                return False
-            self.logger.info("Trying to decode with encoding '{0}'".format(charenc))
-            return data.decode(charenc)
-        except:
-            self.logger.warning("Failed reading binary file!", exc_info=True)
-        return False
+            with open(path, "rb") as f:
+                data = f.read()
+        except (IOError, OSError):
+            self.logger.exception("Failed reading file '{file}'".format(file=path))
+            return False, None, None
+        digest = hashlib.sha1(data).hexdigest()
+        for encoding in self._get_encodings(data):
+            try:
+                text = data.decode(encoding)
+            except (UnicodeDecodeError, LookupError):
+                self.logger.info("Decoding '{0}' as {1} failed.".format(path, encoding))
+                continue
+            if "\r" in text:
+                # Translate line breaks like files opened in text mode
+                text = text.replace("\r\n", "\n").replace("\r", "\n")
+            self.logger.info("Decoded '{0}' as {1} in {2:.3f}s.".format(path, encoding, time.time() - start))
+            return text, encoding, digest
+        self.logger.warning("Failed to decode file '{file}'".format(file=path))
+        return False, None, None
 
     def reload(self):
         """Reload file data."""
-        return self.load()
+        # The unsaved edits are discarded
+        self.close_journal()
+        return self.load(background=True)
 
     def is_changed(self):
-        """Check if the editor data is different from the file."""
-        return self.editor.get_data() != self.data
+        """Check if the editor data has changed since the file was loaded or saved."""
+        return self.editor.is_modified()
 
     def is_changed_on_disk(self):
-        path = self._path()
-        if os.path.isfile(path):
-            data = self._read(path)
-            if data != self.data:
-                return True
-        return False
+        """Check if the file was changed by another program since it was loaded or saved.
+
+        The contents are only compared if the metadata of the file has changed.
+        """
+        state = get_state(self._path())
+        if state is None or state == self.disk_state:
+            return False
+        return hash_file(self._path()) != self.disk_hash
 
     def is_writable(self):
         """Check if the file is writable."""
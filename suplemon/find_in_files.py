@@ -0,0 +1,204 @@
+# -*- encoding: utf-8
+"""
+Search for a pattern in the files of a directory tree in worker processes.
+"""
+
+import os
+import re
+import mmap
+import logging
+import functools
+import multiprocessing
+
+
+def iter_files(path):
+    """Walk a directory tree and yield the paths of the files in it.
+
+    Hidden files and directories (names beginning with a dot) are skipped
+    and symbolic links aren't followed.
+
+    :param str path: The directory to walk.
+    """
+    stack = [path]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+        except OSError:
+            continue
+        subdirs = []
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry.path
+            except OSError:
+                continue
+        # Walk the subdirectories in alphabetical order
+        stack.extend(reversed(subdirs))
+
+
+def search_file(path, pattern, flags=0, max_matches=1000, max_line_length=300):
+    """Search a file for a regular expression.
+
+    The file is memory mapped and searched as bytes, so it's never read
+    into memory as a whole. Files that look binary are skipped. This is
+    run in the worker processes of FileSearch.
+
+    :param str path: Path of the file.
+    :param str pattern: Regular expression to search for.
+    :param int flags: Flags for compiling the regular expression.
+    :param int max_matches: Maximum amount of matches to return.
+    :param int max_line_length: Maximum length of the returned lines.
+    :return: Tuple (path, matches) where matches is a list of (line_number, column, line) tuples.
+    """
+    matches = []
+    try:
+        with open(path, "rb") as f:
+            if not os.fstat(f.fileno()).st_size:
+                return path, matches
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (IOError, OSError, ValueError):
+        return path, matches
+    try:
+        if data.find(b"\0", 0, 8192) != -1:
+            return path, matches
+        regex = re.compile(pattern.encode("utf-8"), flags)
+        line_number = 0
+        line_start = 0
+        # Columns are counted from the previous match on the same line, so long lines are decoded only once
+        column = 0
+        column_start = 0
+        for match in regex.finditer(data):
+            start = match.start()
+            # Only the data after the previous match is scanned for newlines
+            newlines = data[column_start:start].count(b"\n")
+            if newlines:
+                line_number += newlines
+                line_start = data.rfind(b"\n", column_start, start) + 1
+                column = 0
+                column_start = line_start
+            column += len(data[column_start:start].decode("utf-8", "replace"))
+            column_start = start
+            # Show the part of long lines around the match
+            text_start = max(line_start, start - max_line_length // 2)
+            text_end = data.find(b"\n", start, text_start + max_line_length)
+            if text_end == -1:
+                text_end = min(len(data), text_start + max_line_length)
+            line = data[text_start:text_end].decode("utf-8", "replace").rstrip("\r")
+            matches.append((line_number, column, line))
+            if len(matches) >= max_matches:
+                break
+    finally:
+        data.close()
+    return path, matches
+
+
+def search_files(paths, pattern, flags=0):
+    """Search a batch of files with search_file and return a list of their results."""
+    return [search_file(path, pattern, flags) for path in paths]
+
+
+class FileSearch(object):
+    """Searches the files of a directory tree for a pattern in worker processes.
+
+    The directory is walked on the task handler thread of a process pool
+    while the files found so far are searched by the worker processes in
+    batches of batch_size files. Results are collected without blocking
+    with get_results(), in the order the batches are finished.
+    """
+
+    batch_size = 32
+
+    def __init__(self, what, path, regex=False, processes=None):
+        """
+        :param str what: String to search for.
+        :param str path: The directory to search in.
+        :param bool regex: Whether what is a regular expression. Invalid
+            expressions are searched for as normal strings.
+        :param int processes: Amount of worker processes, the amount of CPUs by default.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.what = what
+        self.path = path
+        self.processes = processes
+        self.pattern = re.escape(what)
+        self.flags = 0
+        if regex:
+            try:
+                re.compile(what.encode("utf-8"), re.MULTILINE)
+                self.pattern = what
+                self.flags = re.MULTILINE
+            except re.error:
+                pass
+        self.pool = None
+        self.results = None
+        # Amount of files searched and matches found so far
+        self.files = 0
+        self.matches = 0
+        self.running = False
+        self.cancelled = False
+
+    def start(self):
+        """Start searching in the background."""
+        # Forked workers would get copies of locks held by the other threads of the editor,
+        # so they're started from a separate process that doesn't run any threads
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        self.pool = context.Pool(self.processes)
+        job = functools.partial(search_files, pattern=self.pattern, flags=self.flags)
+        self.results = self.pool.imap_unordered(job, self._iter_batches())
+        self.running = True
+
+    def is_running(self):
+        return self.running
+
+    def get_results(self):
+        """Return the results of the files that were searched since the last call.
+
+        :return: List of (path, matches) tuples for files with matches. See search_file.
+        """
+        found = []
+        while self.running:
+            try:
+                batch = self.results.next(0)
+            except multiprocessing.TimeoutError:
+                break
+            except StopIteration:
+                # Wait for the finished workers to exit
+                self.pool.close()
+                self.pool.join()
+                self.running = False
+                break
+            except Exception:
+                self.logger.exception("Searching files failed.")
+                continue
+            self.files += len(batch)
+            for path, matches in batch:
+                if matches:
+                    self.matches += len(matches)
+                    found.append((path, matches))
+        return found
+
+    def cancel(self):
+        """Stop searching and the worker processes."""
+        if not self.running:
+            return
+        self.cancelled = True
+        self.running = False
+        self.pool.terminate()
+
+    def _iter_batches(self):
+        batch = []
+        for path in iter_files(self.path):
+            if self.cancelled:
+                return
+            batch.append(path)
+            if len(batch) == self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
@@ -0,0 +1,59 @@
+# -*- encoding: utf-8
+"""
+Scheduler for deciding when to render frames while handling input.
+"""
+
+import time
+
+
+class FrameScheduler(object):
+    """Decides when input has been handled long enough to render a frame.
+
+    Input that arrives in bursts (key repeat, fast typing or pasting) is
+    handled without rendering in between, and a frame is rendered when the
+    input stops. Frames aren't rendered more often than frame_rate per
+    second, but a frame is always rendered within 'latency' seconds after
+    the first input that hasn't been rendered yet.
+    """
+
+    def __init__(self, frame_rate=60, latency=0.05):
+        """
+        :param float frame_rate: Maximum amount of frames per second.
+        :param float latency: Maximum time in seconds from input to rendering it.
+        """
+        self.interval = 1.0 / frame_rate if frame_rate > 0 else 0
+        self.latency = latency
+        # Time of the last rendered frame
+        self.last_frame = 0
+        # Time of the first input that hasn't been rendered yet
+        self.pending = None
+
+    def input_received(self):
+        """Called when an input event has been handled."""
+        if self.pending is None:
+            self.pending = time.time()
+
+    def frame_rendered(self):
+        """Called when a frame has been rendered."""
+        self.last_frame = time.time()
+        self.pending = None
+
+    def is_due(self, idle):
+        """Check if a frame should be rendered now.
+
+        :param bool idle: Whether there's no more input available right now.
+        :return: True if a frame should be rendered.
+        """
+        if self.pending is None:
+            return idle
+        now = time.time()
+        if now >= self.pending + self.latency:
+            return True
+        return idle and now >= self.last_frame + self.interval
+
+    def get_wait(self):
+        """Return the time in milliseconds to wait for more input before rendering a frame."""
+        if self.pending is None:
+            return 0
+        due = min(self.last_frame + self.interval, self.pending + self.latency)
+        return max(0, int((due - time.time()) * 1000 + 0.5))
@@ -0,0 +1,272 @@
+# -*- encoding: utf-8
+"""
+Journal of unsaved edits for recovering them after a crash.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+
+from .buffer import ChangeTracker
+
+
+class EditJournal(object):
+    """Append-only journal of the edits made to a file since it was saved.
+
+    Changes to the line buffer are collected with a ChangeTracker and appended
+    to the journal in batches. The journal is a file of JSON records, one per
+    line. The first record describes the file on disk that the edits apply
+    to, and the following records are [start, removed, lines] edits that
+    replace 'removed' lines at 'start' with 'lines'. When the journal grows
+    large it's compacted into a single edit that covers all changed lines.
+
+    If the app is killed before the file is saved, the edits are replayed on
+    top of the file when it's opened the next time.
+    """
+
+    # Journal size in bytes after which it's compacted
+    compact_size = 1024 * 1024
+
+    def __init__(self, path, directory):
+        """
+        :param str path: Path of the file being edited.
+        :param str directory: Directory to store the journal in.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.directory = directory
+        self.set_path(path)
+        # Changes that haven't been written yet
+        self.tracker = ChangeTracker()
+        # All changes since the file was loaded or saved, used for compaction
+        self.total = ChangeTracker()
+        # Changes made while the file is saved in the background
+        self.saving = None
+        # Size and modification time of the file that the edits apply to
+        self.base = None
+        # Amount of lines in the file that the edits apply to
+        self.base_lines = 0
+        # Size of the journal file in bytes, 0 if it isn't written yet
+        self.size = 0
+        self.compact_at = self.compact_size
+        self.last_write = time.time()
+
+    def set_path(self, path):
+        """Set the path of the file being edited."""
+        self.path = os.path.abspath(path)
+        name = hashlib.sha1(self.path.encode("utf-8")).hexdigest()
+        self.journal_path = os.path.join(self.directory, name + ".journal")
+
+    def load(self, buffer, recover=True):
+        """Start journaling the edits of buffer, which contains the file as it is on disk.
+
+        :param LineBuffer buffer: Line buffer of the file.
+        :param bool recover: Replay the edits of an existing journal on buffer.
+        :return: True if edits were recovered.
+        """
+        for tracker in (self.tracker, self.total):
+            if tracker.buffer:
+                tracker.buffer.remove_tracker(tracker)
+            buffer.add_tracker(tracker)
+            tracker.reset()
+        self._set_base(len(buffer))
+        self.size = 0
+        self.compact_at = self.compact_size
+        recovered = False
+        if recover and os.path.isfile(self.journal_path):
+            recovered = self._recover(buffer)
+        if not recovered:
+            self._remove()
+        # Recovered edits are already in the journal
+        self.tracker.reset()
+        return recovered
+
+    def close(self):
+        """Stop journaling and forget the unsaved edits."""
+        for tracker in (self.tracker, self.total, self.saving):
+            if tracker and tracker.buffer:
+                tracker.buffer.remove_tracker(tracker)
+        self.saving = None
+        self._remove()
+
+    def update(self, interval):
+        """Write pending edits if interval seconds have passed since the last write.
+
+        :param float interval: Seconds between writes.
+        :return: True if there are edits that aren't written yet.
+        """
+        if not self.tracker.has_changes():
+            return False
+        if time.time() - self.last_write < interval:
+            return True
+        self.write()
+        return False
+
+    def write(self):
+        """Append pending edits to the journal."""
+        changed = self.tracker.take()
+        self.last_write = time.time()
+        if changed is None:
+            return False
+        start, old_end, new_end = changed
+        records = []
+        if not self.size:
+            records.append(self._header())
+        records.append([start, old_end - start, list(self.tracker.buffer.iter_data(start, new_end))])
+        try:
+            self._append(records)
+        except (IOError, OSError):
+            self.logger.exception("Failed writing journal '{0}'".format(self.journal_path))
+            return False
+        if self.size >= self.compact_at:
+            self.compact()
+        return True
+
+    def compact(self):
+        """Replace the journal with a single edit of all the lines changed since the file was saved."""
+        changed = self._peek(self.total)
+        if changed is None:
+            self._remove()
+            return
+        start, old_end, new_end = changed
+        records = [self._header(), [start, old_end - start, list(self.total.buffer.iter_data(start, new_end))]]
+        temp_path = self.journal_path + ".tmp"
+        try:
+            f = self._open(temp_path, os.O_TRUNC)
+            with f:
+                f.write(self._dump(records))
+            getattr(os, "replace", os.rename)(temp_path, self.journal_path)
+        except (IOError, OSError):
+            self.logger.exception("Failed compacting journal '{0}'".format(self.journal_path))
+            return
+        self.size = os.path.getsize(self.journal_path)
+        # Don't compact again until the journal has grown considerably
+        self.compact_at = max(self.compact_size, self.size * 2)
+
+    def begin_save(self):
+        """Called when the contents of the buffer are taken to be saved."""
+        self.saving = ChangeTracker()
+        self.total.buffer.add_tracker(self.saving)
+
+    def end_save(self, saved, path):
+        """Called when the file has been saved.
+
+        :param bool saved: Whether the file was written successfully.
+        :param str path: Path the file was saved to.
+        """
+        saving = self.saving
+        self.saving = None
+        if saving is None:
+            return
+        buffer = saving.buffer
+        buffer.remove_tracker(saving)
+        if not saved:
+            return
+        self._remove()
+        self.set_path(path)
+        # Only the edits made during the save are unsaved now
+        buffer.remove_tracker(self.total)
+        buffer.add_tracker(saving)
+        self.total = saving
+        self._set_base(len(buffer) - saving.delta)
+        self.size = 0
+        self.compact_at = self.compact_size
+        # Write the edits made during the save relative to the saved file
+        self.tracker.reset()
+        changed = self._peek(saving)
+        if changed is not None:
+            start, old_end, new_end = changed
+            self.tracker.replaced(start, old_end - start, new_end - start)
+
+    def _peek(self, tracker):
+        """Return the changed range of a tracker without resetting it."""
+        changed = tracker.take()
+        if changed is not None:
+            start, old_end, new_end = changed
+            tracker.replaced(start, old_end - start, new_end - start)
+        return changed
+
+    def _set_base(self, lines):
+        try:
+            stat = os.stat(self.path)
+            self.base = [stat.st_size, stat.st_mtime]
+        except OSError:
+            self.base = None
+        self.base_lines = lines
+
+    def _header(self):
+        return {"path": self.path, "base": self.base, "lines": self.base_lines}
+
+    def _dump(self, records):
+        return "".join(json.dumps(record) + "\n" for record in records)
+
+    def _append(self, records):
+        if not os.path.isdir(self.directory):
+            # Journals have the unsaved contents of files, so only the user may read them
+            os.makedirs(self.directory, 0o700)
+        data = self._dump(records)
+        f = self._open(self.journal_path, os.O_APPEND)
+        with f:
+            f.write(data)
+        self.size += len(data)
+
+    def _open(self, path, flags):
+        """Open a journal file for writing, creating it readable and writable by the user only.
+
+        :param str path: Path of the file.
+        :param int flags: Flags for os.open in addition to os.O_WRONLY and os.O_CREAT.
+        """
+        return os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | flags, 0o600), "w")
+
+    def _remove(self):
+        self.size = 0
+        if os.path.isfile(self.journal_path):
+            try:
+                os.remove(self.journal_path)
+            except OSError:
+                self.logger.exception("Failed removing journal '{0}'".format(self.journal_path))
+
+    def _read(self):
+        """Read the records of the journal, ignoring a partially written last record."""
+        records = []
+        try:
+            f = open(self.journal_path)
+            with f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        break
+        except (IOError, OSError):
+            self.logger.exception("Failed reading journal '{0}'".format(self.journal_path))
+        return records
+
+    def _recover(self, buffer):
+        """Replay the edits of the journal on buffer if they apply to it."""
+        records = self._read()
+        if not records or not isinstance(records[0], dict):
+            return False
+        header = records[0]
+        edits = records[1:]
+        if header.get("path") != self.path or header.get("base") != self.base:
+            self.logger.warning("The file has changed since journal '{0}' was written.".format(self.journal_path))
+            return False
+        # Make sure all edits apply before changing anything
+        length = header.get("lines")
+        if length != len(buffer):
+            return False
+        for edit in edits:
+            start, removed, lines = edit
+            if start < 0 or removed < 0 or start + removed > length:
+                self.logger.warning("Invalid edit in journal '{0}'.".format(self.journal_path))
+                return False
+            length += len(lines) - removed
+        if not edits:
+            return False
+        for start, removed, lines in edits:
+            buffer[start:start + removed] = lines
+        self.size = os.path.getsize(self.journal_path)
+        self.compact_at = max(self.compact_size, self.size * 2)
+        self.logger.info("Recovered {0} edits from journal '{1}'.".format(len(edits), self.journal_path))
+        return True
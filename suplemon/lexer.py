@@ -2,8 +2,39 @@
 
 import pygments
 import pygments.token
+import pygments.lexer
+import pygments.filter
 import pygments.lexers
 
+from .buffer import ChangeTracker
+
+# Token types of find in files results
+FileName = pygments.token.Token.FindInFiles.FileName
+LineNumber = pygments.token.Token.FindInFiles.LineNumber
+
+
+class ScopeMap(dict):
+    """Memoized mapping of Pygments token types to scope names.
+
+    Token types that aren't in the token map are resolved to the scope of
+    their nearest mapped parent when they're first looked up.
+    """
+
+    def __init__(self, token_map):
+        dict.__init__(self)
+        self.token_map = token_map
+
+    def __missing__(self, token):
+        scope = "global"
+        parent = token
+        while parent is not None:
+            if parent in self.token_map:
+                scope = self.token_map[parent]
+                break
+            parent = parent.parent
+        self[token] = scope
+        return scope
+
 
 class Lexer:
     def __init__(self, app):
@@ -25,7 +56,11 @@ class Lexer:
             pygments.token.Name: "entity.name",
             pygments.token.Keyword: "keyword",
             pygments.token.Generic.Deleted: "invalid",
+            FileName: "entity.name.filename.find-in-files",
+            LineNumber: "constant.numeric.line-number.find-in-files - match",
         }
+        # Memoized scopes by token type, see get_scope
+        self.scopes = ScopeMap(self.token_map)
 
     def lex(self, code, lex):
         """Return tokenified code.
@@ -43,15 +78,395 @@ class Lexer:
                 code = code.decode("utf-8")
             return (("global", code),)
 
-        words = pygments.lex(code, lex)
+        scopes = self.scopes
+        return [(scopes[token], word) for token, word in pygments.lex(code, lex)]
+
+    def get_scope(self, token):
+        """Return the scope name of a Pygments token type.
+
+        Token types that aren't in the token map get the scope of their
+        nearest mapped parent (e.g. Keyword.Namespace is a keyword), or
+        "global" if there is none.
+
+        :param token: Pygments token type.
+        :return: Scope name.
+        """
+        return self.scopes[token]
+
+    def can_resume(self, lex):
+        """Check if lexing with lex can be continued from the state at the end of a line.
+
+        This is possible for regex based Pygments lexers that don't override the
+        default tokenizer or use filters.
+        """
+        if not isinstance(lex, pygments.lexer.RegexLexer) or lex.filters:
+            return False
+        for cls in type(lex).__mro__:
+            if cls is pygments.lexer.RegexLexer:
+                return True
+            if "get_tokens_unprocessed" in cls.__dict__:
+                return False
+        return False
+
+    def lex_line(self, line, lex, state=None):
+        """Return tokenified line and the lexer state at the end of it.
+
+        :param str line: Line to tokenify without the line break.
+        :param lex: Lexer to use.
+        :param tuple state: Lexer state at the start of the line or None for the initial state.
+        :return: Tuple (scopes, state) where scopes is a list of (scope, word) tuples.
+            The state is None if the lexer can't be resumed.
+        """
+        return self.lex_lines([line], lex, state)[0]
+
+    def lex_lines(self, lines, lex, state=None):
+        """Tokenify consecutive lines, continuing the lexer state from line to line.
+
+        The lines are lexed as one text, so tokens that span several lines
+        (e.g. block comments) are found like when lexing the whole text.
+
+        :param lines: Iterable of lines without line breaks.
+        :param lex: Lexer to use.
+        :param tuple state: Lexer state at the start of the first line or None for the initial state.
+        :return: List with a (scopes, state) tuple for each line, like lex_line returns.
+            The state is None if a token continues on the next line.
+        """
+        return [(scopes, state) for scopes, state, resumable in self._lex_text(list(lines), lex, state)]
+
+    def lex_block(self, lines, lex, state=None, min_lines=0):
+        """Tokenify lines as one text up to a line where lexing can be continued.
+
+        Lines after the first min_lines are only lexed until no token
+        continues from one line to the next. The rest of the lines are only
+        used for finding tokens that span several lines.
+
+        :param list lines: Lines without line breaks.
+        :param lex: Lexer to use.
+        :param tuple state: Lexer state at the start of the first line or None for the initial state.
+        :param int min_lines: Minimum amount of lines to tokenify.
+        :return: Tuple (scopes, count, state) where scopes has a list of (scope, word) tuples
+            for each of the first count lines and state is the lexer state after them.
+        """
+        result = self._lex_text(lines, lex, state, max(min_lines, 1))
+        if not result:
+            return [], 0, state
+        return [item[0] for item in result], len(result), result[-1][1]
+
+    def _lex_text(self, lines, lex, state=None, min_lines=None):
+        """Lex lines as one text and split the tokens at the line breaks.
+
+        :param list lines: Lines without line breaks.
+        :param lex: Lexer to use.
+        :param tuple state: Lexer state at the start of the first line or None for the initial state.
+        :param int min_lines: Stop at the first line end after min_lines lines where lexing can be
+            continued, or None to lex all lines.
+        :return: List with a (scopes, state, resumable) tuple for each line. Resumable tells if
+            no token continues on the next line, and state is the lexer state at the end of the
+            line if it is resumable and the lexer can be resumed.
+        """
+        if not lines:
+            return []
+        text = "\n".join(lines) + "\n"
+        scope_map = self.scopes
+        # Tokens of each line, a token with line breaks is split on several lines
+        line_scopes = [[]]
+        # (state, resumable) for each line end that lexing has passed
+        ends = []
+        # Offset of the start of the line after the next line end
+        boundary = len(lines[0]) + 1
+        stopped = False
+
+        def add(token, word):
+            scope = scope_map[token]
+            parts = word.split("\n")
+            line_scopes[-1].append((scope, parts[0]))
+            for part in parts[1:]:
+                line_scopes.append([(scope, part)])
+
+        def passed(pos, statestack):
+            """Record the line ends before pos, return True to stop lexing."""
+            nonlocal boundary, stopped
+            while boundary <= pos and len(ends) < len(lines):
+                # A token that ends in the indentation of the next line doesn't need to be continued
+                resumable = boundary == pos or text[boundary:pos].isspace()
+                ends.append((tuple(statestack) if resumable and statestack else None, resumable))
+                if len(ends) < len(lines):
+                    boundary += len(lines[len(ends)]) + 1
+                if resumable and min_lines is not None and len(ends) >= min_lines:
+                    stopped = True
+                    break
+            return stopped
 
-        scopes = []
-        for word in words:
-            token = word[0]
-            scope = "global"
+        if not self.can_resume(lex):
+            # Lexing from the start of a line that no token continues to is the best guess
+            stream = ((token, word) for index, token, word in lex.get_tokens_unprocessed(text))
+            if lex.filters:
+                stream = pygments.filter.apply_filters(stream, lex.filters, lex)
+            pos = 0
+            for token, word in stream:
+                add(token, word)
+                pos += len(word)
+                if passed(pos, None):
+                    break
+        else:
+            # Same as RegexLexer.get_tokens_unprocessed but keeps the state stack
+            tokendefs = lex._tokens
+            token_type = pygments.token._TokenType
+            statestack = list(state or ("root",))
+            statetokens = tokendefs[statestack[-1]]
+            pos = 0
+            while 1:
+                for rexmatch, action, new_state in statetokens:
+                    m = rexmatch(text, pos)
+                    if m:
+                        if action is not None:
+                            if type(action) is token_type:
+                                add(action, m.group())
+                            else:
+                                for item in action(lex, m):
+                                    add(item[1], item[2])
+                        pos = m.end()
+                        if new_state is not None:
+                            if isinstance(new_state, tuple):
+                                for s in new_state:
+                                    if s == "#pop":
+                                        if len(statestack) > 1:
+                                            statestack.pop()
+                                    elif s == "#push":
+                                        statestack.append(statestack[-1])
+                                    else:
+                                        statestack.append(s)
+                            elif isinstance(new_state, int):
+                                if abs(new_state) >= len(statestack):
+                                    del statestack[1:]
+                                else:
+                                    del statestack[new_state:]
+                            elif new_state == "#push":
+                                statestack.append(statestack[-1])
+                            statetokens = tokendefs[statestack[-1]]
+                        break
+                else:
+                    if pos >= len(text):
+                        break
+                    if text[pos] == "\n":
+                        # At the end of the line the state is reset to root
+                        statestack = ["root"]
+                        statetokens = tokendefs["root"]
+                        add(pygments.token.Text, "\n")
+                    else:
+                        add(pygments.token.Error, text[pos])
+                    pos += 1
+                if passed(pos, statestack):
+                    break
 
-            if token in self.token_map.keys():
-                scope = self.token_map[token]
+        if not stopped:
+            # In case the lexer didn't return all of the text
+            passed(len(text), None)
+        result = []
+        for scopes, end in zip(line_scopes, ends):
+            scopes = [item for item in scopes if item[1]]
+            result.append((self._string_whitespace(scopes), end[0], end[1]))
+        return result
 
-            scopes.append((scope, word[1]))
+    def _string_whitespace(self, scopes):
+        """Give whitespace tokens between two string tokens the string scope.
+
+        Some lexers emit the whitespace inside string literals as separate
+        text tokens, which would leave uncolored gaps in the strings.
+
+        :param list scopes: List of (scope, word) tuples, modified in place.
+        :return: The list.
+        """
+        for i in range(1, len(scopes) - 1):
+            scope, word = scopes[i]
+            if scope != "string" and word.isspace() and scopes[i-1][0] == scopes[i+1][0] == "string":
+                scopes[i] = ("string", word)
         return scopes
+
+
+class FindInFilesLexer(pygments.lexer.RegexLexer):
+    """Lexer for the results of find in files, with lines like 'path:line:column: text'."""
+
+    name = "Find in files"
+    aliases = ["find-in-files"]
+    tokens = {
+        "root": [
+            (r"(.+?)(:)(\d+)(:)(\d+)(:)(.*\n)", pygments.lexer.bygroups(
+                FileName, pygments.token.Punctuation, LineNumber, pygments.token.Punctuation, LineNumber,
+                pygments.token.Punctuation, pygments.token.Text)),
+            (r".*\n", pygments.token.Comment),
+        ]
+    }
+
+
+class TokenCache(object):
+    """Caches tokenified lines of a line buffer.
+
+    Lines are lexed in blocks of about 'interval' lines. Each block is lexed
+    as one text together with the next 'interval' lines, so that multi line
+    comments and strings are highlighted like when lexing the whole file (as
+    long as they don't continue further than that past the block). The lexer
+    state at the start of every block is stored as a checkpoint. Blocks are
+    cached by their contents and starting state, which means that only blocks
+    near edited lines and blocks whose starting state changed need to be
+    lexed again.
+
+    Lines longer than max_line_length aren't lexed at all. Their tokens are
+    None and they're lexed as empty lines, so that the viewer can lex just
+    the visible part of them.
+    """
+
+    # Amount of lines between checkpoints
+    interval = 32
+    # Maximum amount of lines in the cached blocks
+    max_cached_lines = 10000
+
+    def __init__(self, lexer, syntax, max_line_length=0):
+        """
+        :param Lexer lexer: The Lexer instance used for tokenifying.
+        :param syntax: The Pygments lexer to use.
+        :param int max_line_length: Length of the longest line to lex, 0 for no limit.
+        """
+        self.lexer = lexer
+        self.syntax = syntax
+        self.max_line_length = max_line_length
+        # Must be added to the line buffer to get notified of changes
+        self.tracker = ChangeTracker()
+        # Checkpoints as [line_number, state, dirty] sorted by line number.
+        # Dirty checkpoints need the block before them lexed again.
+        self.checkpoints = [[0, None, False]]
+        # Amount of checkpoints that are known to be up to date
+        self.verified = 1
+        # Cached (scopes, count, state) tuples by (state, lines), see Lexer.lex_block
+        self.cache = {}
+        self.cached_lines = 0
+
+    def get_tokens(self, start, stop):
+        """Return the tokenified lines from start up to (but not including) stop.
+
+        :return: List with a list of (scope, word) tuples (or None for long lines) for each line.
+        """
+        lines = self.tracker.buffer
+        self._apply_changes()
+        stop = min(stop, len(lines))
+        if start >= stop:
+            return []
+        i = self._find_block(start)
+        result = []
+        while True:
+            line, state = self.checkpoints[i][:2]
+            scopes, end, state = self._lex_block(line, state)
+            result.extend(scopes[max(0, start - line):stop - line])
+            if end >= stop:
+                return result
+            i = self._add_checkpoint(i, end, state)
+
+    def _lex_block(self, line, state):
+        """Lex the block that starts at line.
+
+        :return: Tuple (scopes, end, state) where scopes has the tokens of the
+            lines up to end and state is the lexer state at end.
+        """
+        lines = self.tracker.buffer
+        # The lines after the block are needed for finding tokens that continue past it
+        data = tuple(lines.iter_data(line, min(len(lines), line + 2 * self.interval)))
+        key = (state, data)
+        result = self.cache.get(key)
+        if result is None:
+            if self.cached_lines >= self.max_cached_lines:
+                self.cache.clear()
+                self.cached_lines = 0
+            limit = self.max_line_length
+            texts = [("" if 0 < limit < len(item) else item) for item in data]
+            scopes, count, end_state = self.lexer.lex_block(texts, self.syntax, state, self.interval)
+            if limit:
+                scopes = [(None if 0 < limit < len(item) else item_scopes) for item, item_scopes in zip(data, scopes)]
+            result = (scopes, count, end_state)
+            self.cache[key] = result
+            self.cached_lines += len(data)
+        scopes, count, end_state = result
+        return scopes, line + count, end_state
+
+    def _find(self, line):
+        """Return the index of the last checkpoint at or before line."""
+        checkpoints = self.checkpoints
+        low, high = 0, len(checkpoints)
+        while high - low > 1:
+            mid = (low + high) // 2
+            if checkpoints[mid][0] <= line:
+                low = mid
+            else:
+                high = mid
+        return low
+
+    def _find_block(self, line):
+        """Return the index of the up to date checkpoint that starts the block containing line."""
+        while True:
+            i = min(self._find(line), self.verified - 1)
+            if i + 1 < self.verified:
+                return i
+            # The block of the last up to date checkpoint needs to be lexed to find where it ends
+            end, state = self._lex_block(*self.checkpoints[i][:2])[1:]
+            if end > line:
+                return i
+            self._add_checkpoint(i, end, state)
+
+    def _add_checkpoint(self, i, line, state):
+        """Store the state at the end of the block of checkpoint i as the next checkpoint.
+
+        :return: Index of the next checkpoint.
+        """
+        checkpoints = self.checkpoints
+        # Checkpoints inside the block are outdated
+        j = i + 1
+        while j < len(checkpoints) and checkpoints[j][0] < line:
+            j += 1
+        del checkpoints[i + 1:j]
+        if line >= len(self.tracker.buffer):
+            del checkpoints[i + 1:]
+            self.verified = len(checkpoints)
+            return i + 1
+        changed = True
+        if i + 1 < len(checkpoints) and checkpoints[i + 1][0] == line:
+            checkpoint = checkpoints[i + 1]
+            changed = checkpoint[1] != state
+            checkpoint[1] = state
+            checkpoint[2] = False
+        else:
+            checkpoints.insert(i + 1, [line, state, False])
+        verified = max(self.verified, i + 2)
+        if changed and i + 2 < len(checkpoints):
+            # The next block was lexed with a different starting state
+            checkpoints[i + 2][2] = True
+            verified = i + 2
+        # Checkpoints after blocks that weren't changed are up to date too
+        while verified < len(checkpoints) and not checkpoints[verified][2]:
+            verified += 1
+        self.verified = verified
+        return i + 1
+
+    def _apply_changes(self):
+        """Update checkpoints after lines were changed."""
+        changed = self.tracker.take()
+        if changed is None:
+            return
+        start, old_end, new_end = changed
+        delta = new_end - old_end
+        checkpoints = self.checkpoints[:1]
+        previous = 0
+        for checkpoint in self.checkpoints[1:]:
+            line = checkpoint[0]
+            if previous + 2 * self.interval > start:
+                # The block before the checkpoint was lexed with the changed lines
+                checkpoint[2] = True
+                self.verified = min(self.verified, len(checkpoints))
+            previous = line
+            if line > start:
+                if line < old_end:
+                    # The line was changed or removed
+                    continue
+                checkpoint[0] += delta
+                if checkpoint[0] <= checkpoints[-1][0]:
+                    continue
+            checkpoints.append(checkpoint)
+        self.checkpoints = checkpoints
@@ -3,14 +3,132 @@
 Line object to represent a single line in the text editor.
 """
 
+import weakref
+
+
+class LineMetadata(object):
+    """Sparse per-line metadata stored in columns.
+
+    Each attribute is a column that maps Line instances to values. Only lines
+    with a value other than the default are stored, and lines are dropped
+    from the columns when they are garbage collected.
+    """
+
+    def __init__(self):
+        self.columns = {}
+
+    def get(self, line, name, default=None):
+        """Get the value of an attribute of a line."""
+        column = self.columns.get(name)
+        if not column:
+            return default
+        return column.get(line, default)
+
+    def set(self, line, name, value, default=None):
+        """Set the value of an attribute of a line. Default values aren't stored."""
+        column = self.columns.get(name)
+        if value == default:
+            if column:
+                column.pop(line, None)
+            return
+        if column is None:
+            column = self.columns[name] = weakref.WeakKeyDictionary()
+        column[line] = value
+
+    def get_lines(self, name):
+        """Get the lines that have a value for an attribute."""
+        column = self.columns.get(name)
+        if not column:
+            return []
+        return list(column.keys())
+
+    def clear(self, name):
+        """Reset an attribute of all lines to the default."""
+        self.columns.pop(name, None)
+
+
+def metadata_property(name, default):
+    """Create a property for a line attribute that is stored in the line's metadata.
+
+    Lines that aren't in a line buffer keep their attributes in a dict of
+    their own, which is moved to the metadata of the buffer when the line is
+    added to one.
+    """
+    def get_metadata(line):
+        owner = line._owner
+        if owner is None or owner.metadata is None:
+            return None
+        if line._metadata is not None:
+            line._move_metadata()
+        return owner.metadata
+
+    def fget(self):
+        metadata = get_metadata(self)
+        if metadata is None:
+            if self._metadata is None:
+                return default
+            return self._metadata.get(name, default)
+        return metadata.get(self, name, default)
+
+    def fset(self, value):
+        metadata = get_metadata(self)
+        if metadata is None:
+            if value == default:
+                if self._metadata is not None:
+                    self._metadata.pop(name, None)
+                return
+            if self._metadata is None:
+                self._metadata = {}
+            self._metadata[name] = value
+        else:
+            metadata.set(self, name, value, default)
+
+    return property(fget, fset)
+
+
+class Line(object):
+    # Lines are kept small since there can be millions of them. Additional
+    # attributes are stored in the LineMetadata of the viewer.
+    __slots__ = ("_owner", "_data", "_metadata", "__weakref__")
 
-class Line:
     def __init__(self, data=""):
         if isinstance(data, Line):
             data = data.data
-        self.data = data
-        self.x_scroll = 0
-        self.number_color = 8
+        # The buffer (or buffer block) that is notified when the data changes
+        self._owner = None
+        self._data = data
+        # Attributes of the line while it isn't in a line buffer
+        self._metadata = None
+
+    x_scroll = metadata_property("x_scroll", 0)
+    number_color = metadata_property("number_color", 8)
+    # Linting messages set by the linter module
+    linting = metadata_property("linting", False)
+
+    def set_owner(self, owner):
+        """Set the buffer (or buffer block) that the line is in."""
+        self._owner = owner
+        if self._metadata is not None:
+            self._move_metadata()
+
+    def _move_metadata(self):
+        """Move the attributes kept on the line to the metadata of its buffer."""
+        metadata = self._owner.metadata
+        if metadata is None:
+            return
+        for name, value in self._metadata.items():
+            metadata.set(self, name, value)
+        self._metadata = None
+
+    @property
+    def data(self):
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+        if self._owner is not None:
+            self._owner.line_changed(self)
 
     def __getitem__(self, i):
         return self.data[i]
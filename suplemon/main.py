@@ -14,6 +14,10 @@ from . import themes
 from . import helpers
 
 from .file import File
+from .watcher import FileWatcher
+from .frames import FrameScheduler
+from .status import StatusWorker
+from .find_in_files import FileSearch
 from .logger import logger
 from .config import Config
 from .editor import Editor
@@ -48,9 +52,16 @@ class App:
         self.ui = None
         self.modules = None
         self.themes = None
-
-        # Maximum amount of inputs to process at once
-        self.max_input = 100
+        self.watcher = None
+        # Decides when to render frames while handling input
+        self.frames = None
+        # Updates status bar values of modules in the background
+        self.status_worker = StatusWorker()
+        # The running find in files search and the file its results are added to
+        self.file_search = None
+        self.find_results = None
+        # The directory that the paths of the find in files results are relative to
+        self.find_results_path = None
 
         # Save filenames for later
         self.filenames = filenames
@@ -75,6 +86,7 @@ class App:
             "reload_file": self.reload_file,
             "toggle_mouse": self.toggle_mouse,
             "toggle_fullscreen": self.toggle_fullscreen,
+            "find_in_files": self.find_in_files,
         }
 
         # Bind our logger
@@ -117,6 +129,19 @@ class App:
         # Load themes
         self.themes = themes.ThemeLoader(self)
 
+        # Watch open files for changes made by other programs
+        watch_interval = self.config["app"].get("watch_interval")
+        if watch_interval:
+            self.watcher = FileWatcher(watch_interval)
+            self.watcher.start()
+
+        # Open results of find in files with enter and cancel the search with escape
+        self.set_event_binding("enter", "before", self.on_find_results_enter)
+        self.set_event_binding("escape", "before", self.on_find_results_escape)
+
+        app_config = self.config["app"]
+        self.frames = FrameScheduler(app_config.get("frame_rate", 60), app_config.get("frame_latency", 0.05))
+
         # Indicate that initialization is complete
         self.inited = True
 
@@ -126,6 +151,13 @@ class App:
         """Stop the main loop and exit."""
         self.trigger_event_before("app_exit")
         self.running = False
+        # Unsaved edits were discarded by exiting
+        for f in self.files:
+            f.close()
+        if self.watcher:
+            self.watcher.stop()
+        self.status_worker.stop()
+        self.cancel_find_in_files()
 
     def run(self):
         """Run the app via the ui wrapper."""
@@ -177,28 +209,48 @@ class App:
     def main_loop(self):
         """Run the terminal IO loop until exit() is called."""
         while self.running:
+            # Add lines of files that are loading in the background
+            loading = self.update_loading_files()
+            # Finish saves of files that are saved in the background
+            saving = self.update_saving_files()
+            # Write unsaved edits to the crash recovery journals
+            journaling = self.update_journals()
+            # Add results of find in files as they're found
+            searching = self.update_find_in_files()
+            # Ask to reload files that were changed by other programs
+            self.update_changed_files()
             # Update ui before refreshing it
             self.ui.update()
             self.block_rendering = True
             got_input = False
 
-            # Run through max 100 inputs (so the view is updated at least every 100 characters)
-            for i in range(self.max_input):
+            # Handle input until a frame is due, so bursts of input are rendered at once
+            while True:
                 event = self.ui.get_input(False)  # non-blocking
-
                 if not event:
-                    break  # no more inputs to process at this time
+                    if got_input:
+                        if self.frames.is_due(True):
+                            break
+                        # Wait a moment for more input before rendering
+                        event = self.ui.get_input(True, self.frames.get_wait())
+                    else:
+                        # Wait for input, since there were none already available
+                        # Files that are loading, saving or journaling need to be updated periodically
+                        timeout = None
+                        if loading or saving or journaling or searching:
+                            timeout = 100
+                        elif self.watcher or self.status_worker.providers:
+                            # Notice changed files and status values without waiting for input
+                            timeout = 1000
+                        event = self.ui.get_input(True, timeout)  # blocking
+                    if not event:
+                        break
 
                 got_input = True
-                self.on_input(event)
-
-            if not got_input:
-                # Wait for input, since there were none already available
-                event = self.ui.get_input(True)  # blocking
-
-                if event:
-                    got_input = True
-                    self.on_input(event)  # PERF: Up to 30% processing time
+                self.on_input(event)  # PERF: Up to 30% processing time
+                self.frames.input_received()
+                if not self.running or self.frames.is_due(False):
+                    break
 
             self.block_rendering = False
 
@@ -207,6 +259,79 @@ class App:
             # TODO: Optimize performance. Can make up 45% of processing time in the loop.
             self.get_editor().refresh()
             self.ui.refresh()
+            self.frames.frame_rendered()
+
+    def update_loading_files(self):
+        """Update files that are loading in the background.
+
+        :return: True if any files were loading.
+        :rtype: bool
+        """
+        loading = False
+        for f in self.files:
+            if f.is_loading():
+                f.update_loading()
+                loading = True
+        return loading
+
+    def update_saving_files(self):
+        """Finish saving files that are saved in the background.
+
+        The after event of save_file is triggered again when a save finishes.
+
+        :return: True if any files are still being saved.
+        :rtype: bool
+        """
+        saving = False
+        for f in self.files:
+            if not f.is_saving():
+                continue
+            saved = f.update_saving()
+            if saved is None:
+                saving = True
+                continue
+            self.on_file_saved(f, saved)
+            self.trigger_event_after("save_file")
+        return saving
+
+    def update_journals(self):
+        """Write unsaved edits of files to their journals.
+
+        :return: True if any files have edits that aren't written yet.
+        :rtype: bool
+        """
+        pending = False
+        for f in self.files:
+            if f.update_journal():
+                pending = True
+        return pending
+
+    def update_changed_files(self):
+        """Handle files that the watcher noticed were changed by other programs."""
+        if not self.watcher:
+            return
+        for path in self.watcher.get_changed():
+            for f in self.files:
+                if f.path() == path and not f.is_loading() and not f.is_saving():
+                    self.on_file_changed_on_disk(f)
+
+    def on_file_changed_on_disk(self, f):
+        """Ask to reload a file that was changed by another program.
+
+        Triggers the file_changed_on_disk event, which can be canceled to not ask.
+
+        :param File f: The changed file.
+        """
+        if self.trigger_event_before("file_changed_on_disk"):
+            return False
+        question = "'{0}' was changed on disk, reload it?".format(f.name)
+        if f.is_changed():
+            question = "'{0}' was changed on disk, discard your changes and reload it?".format(f.name)
+        reloaded = False
+        if self.ui.query_bool(question):
+            reloaded = f.reload()
+        self.trigger_event_after("file_changed_on_disk")
+        return reloaded
 
     def get_status(self):
         """Get the current status message.
@@ -279,6 +404,8 @@ class App:
     def reload_config(self):
         """Reload configuration."""
         self.config.reload()
+        # Apply the theme and recompile its colors
+        self.ui.setup_colors()
         for f in self.files:
             self.setup_editor(f.editor)
         self.trigger_event_after("config_loaded")
@@ -465,6 +592,106 @@ class App:
 
         return -1
 
+    def find_in_files(self):
+        """Search for a string in the files of the current directory.
+
+        The results are added to a new file as they're found. Pressing enter on
+        a result opens the file at the match. Pressing escape in the results or
+        closing them cancels the search.
+        """
+        what = self.ui.query("Find in files:", self.get_editor().last_find)
+        if not what:
+            return False
+        self.cancel_find_in_files()
+        path = os.getcwd()
+        search = FileSearch(what, path, self.config["editor"]["regex_find"])
+        try:
+            search.start()
+        except (OSError, ValueError):
+            self.logger.exception("Starting find in files failed.")
+            self.set_status("Starting find in files failed!")
+            return False
+        self.file_search = search
+        if self.find_results not in self.files:
+            self.find_results = self.new_file()
+            self.find_results.set_name("Find in files")
+            self.find_results.editor.set_file_extension("find-in-files")
+        else:
+            self.switch_to_file(self.files.index(self.find_results))
+        self.find_results_path = path
+        self.find_results.set_data("Searching for '{0}' in {1}".format(what, path))
+        return True
+
+    def update_find_in_files(self):
+        """Add the results of the running find in files search to the results file.
+
+        :return: True if the search is still running.
+        :rtype: bool
+        """
+        search = self.file_search
+        if not search:
+            return False
+        lines = []
+        for path, matches in search.get_results():
+            name = os.path.relpath(path, search.path)
+            for line_number, column, line in matches:
+                lines.append("{0}:{1}:{2}: {3}".format(name, line_number + 1, column + 1, line))
+        editor = self.find_results.editor
+        modified = editor.is_modified()
+        if lines:
+            editor.append_lines(lines)
+        if not search.is_running():
+            self.file_search = None
+            status = "Found {0} matches for '{1}' in {2} files.".format(search.matches, search.what, search.files)
+            # Replace the header unless it was edited while searching
+            if editor.lines[0].get_data().startswith("Searching for "):
+                editor.set_line_data(0, status)
+            self.set_status(status)
+        if not modified:
+            # Adding results isn't an unsaved change
+            editor.mark_saved()
+        return self.file_search is not None
+
+    def cancel_find_in_files(self):
+        """Stop the running find in files search."""
+        if not self.file_search:
+            return False
+        self.file_search.cancel()
+        self.file_search = None
+        self.set_status("Find in files canceled.")
+        return True
+
+    def open_find_result(self):
+        """Open the file of the find in files result on the line of the cursor at the match."""
+        editor = self.find_results.editor
+        line = editor.lines[editor.get_cursor().y].get_data()
+        name_row_col = helpers.get_filename_cursor_pos(line)
+        if name_row_col["name"] == line:
+            return False
+        # Paths of results are relative to the directory that was searched
+        name = os.path.join(self.find_results_path, name_row_col["name"])
+        f = self.file_is_open(name)
+        if f:
+            self.switch_to_file(self.files.index(f))
+            f.editor.go_to_pos(name_row_col["row"] + 1, name_row_col["col"])
+        elif self.open_file(name, name_row_col["row"], name_row_col["col"]):
+            self.switch_to_file(self.last_file_index())
+        else:
+            self.set_status("Failed to load '{0}'".format(name))
+            return False
+        return True
+
+    def on_find_results_enter(self, event):
+        if self.find_results and self.get_file() is self.find_results:
+            self.open_find_result()
+            return True
+        return False
+
+    def on_find_results_escape(self, event):
+        if self.find_results and self.get_file() is self.find_results:
+            self.cancel_find_in_files()
+        return False
+
     def run_command(self, data):
         """Run editor commands."""
         parts = data.split(" ")
@@ -487,6 +714,8 @@ class App:
     def run_module(self, module_name, args=""):
         try:
             self.modules.modules[module_name].run(self, self.get_editor(), args)
+            # Record changes made by the module as an undo state
+            self.get_editor().store_action_state(module_name)
             return True
         except:
             # Catch any error when running a module just incase
@@ -509,7 +738,7 @@ class App:
         elif operation in self.modules.modules.keys():
             cancel = self.trigger_event_before(operation)
             if not cancel:
-                result = self.modules.modules[operation].run(self, self.get_editor(), "")
+                result = self.run_module(operation)
             self.trigger_event_after(operation)
             return result
 
@@ -624,7 +853,11 @@ class App:
         if self.get_file().is_changed():
             if not self.ui.query_bool("Close file?"):
                 return False
-        self.files.pop(self.current_file)
+        f = self.files.pop(self.current_file)
+        f.close()
+        if f is self.find_results:
+            self.cancel_find_in_files()
+            self.find_results = None
         if not len(self.files):
             self.new_file()
             return False
@@ -637,16 +870,47 @@ class App:
         # Make sure the file has a name
         if not f.get_name():
             return self.save_file_as(f)
+        if f.is_loading():
+            self.set_status("Can't save '{0}' while it's loading".format(f.name))
+            return False
+        if f.read_only:
+            self.set_status("'{0}' is opened read only".format(f.name))
+            return False
+        if f.is_saving():
+            self.set_status("'{0}' is already being saved".format(f.name))
+            return False
         # Warn if the file has changed on disk
         if not overwrite and f.is_changed_on_disk():
             if not self.ui.query_bool("The file was modified since you opened it, save anyway?"):
                 return False
         # Save the file
-        if f.save():
+        saved = f.save(background=True)
+        if saved and f.is_saving():
+            self.set_status("Saving '{0}'...".format(f.name))
+            return True
+        return self.on_file_saved(f, saved)
+
+    def on_file_saved(self, f, saved):
+        """Show the result of saving a file.
+
+        :param File f: The file that was saved.
+        :param bool saved: Whether the file was written successfully.
+        :return: saved
+        """
+        if saved:
             self.set_status("Saved [{0}] '{1}'".format(helpers.curr_time_sec(), f.name))
             if f.path() == self.config.path() or f.path() == self.config.keymap_path():
                 self.reload_config()
             return True
+        if f.encoding_error:
+            line, column = f.encoding_error
+            text = "Line {0} column {1} of '{2}' can't be saved as {3}. Save it as UTF-8 instead?".format(
+                line + 1, column + 1, f.name, f.get_encoding())
+            if self.ui.query_bool(text):
+                f.encoding = "utf-8"
+                return self.save_file(f, overwrite=True)
+            self.set_status("'{0}' wasn't saved".format(f.name))
+            return False
         self.set_status("Couldn't write to '{0}'".format(f.name))
         return False
 
@@ -702,7 +966,7 @@ class App:
         file = File(self)
         file.set_path(name)
         file.set_editor(self.new_editor())
-        if not file.load():
+        if not file.load(background=True):
             return False
         file.get_editor().set_single_cursor((col, row))
         file.get_editor().scroll_to_line(row)
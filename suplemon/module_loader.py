@@ -29,6 +29,9 @@ class ModuleLoader:
                 inst = self.load_instance(module)
                 if inst:
                     self.modules[module[0]] = inst
+        if self.app:
+            # Update slow status bar values of the loaded modules in the background
+            self.app.status_worker.add_modules(self.modules)
 
     def get_module_names(self):
         """Get names of loadable modules."""
@@ -38,6 +38,9 @@ class AutoComplete(Module):
         """Build the word list based on contents of open files."""
         word_list = []
         for file in self.app.files:
+            if file.read_only:
+                # Don't scan huge files
+                continue
             data = file.get_editor().get_data()
             words = helpers.multisplit(data, self.get_separators())
             for word in words:
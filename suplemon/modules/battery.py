@@ -1,7 +1,6 @@
 # -*- encoding: utf-8
 
 import os
-import time
 import subprocess
 
 from suplemon import helpers
@@ -11,25 +10,12 @@ from suplemon.suplemon_module import Module
 class Battery(Module):
     """Shows remaining battery capacity in the top status bar if available."""
 
-    def init(self):
-        self.last_value = -1
-        self.checked = time.time()
-        self.interval = 60  # Seconds to wait until polling again
-
-    def value(self):
-        """Get the battery charge percent and cache it."""
-        if self.last_value == -1:
-            state = self.battery_status()
-        elif time.time()-self.checked > self.interval:
-            state = self.battery_status()
-        else:
-            return self.last_value
-        self.last_value = state
-        return state
+    # Seconds to wait until polling again. The status is polled in the background.
+    status_interval = 60
 
     def value_str(self):
         """Return formatted value string to show in the UI."""
-        val = self.value()
+        val = self.battery_status()
         if val:
             if self.app.config["app"]["use_unicode_symbols"]:
                 return "\u26A1{0}%".format(str(val))
@@ -38,7 +24,7 @@ class Battery(Module):
         return ""
 
     def get_status(self):
-        """Called by app when showing status bar contents."""
+        """Called every status_interval seconds to update the status bar contents."""
         return self.value_str()
 
     def battery_status(self):
@@ -8,6 +8,8 @@ from suplemon.suplemon_module import Module
 class Clock(Module):
     """Shows a clock in the top status bar."""
 
+    status_interval = 1
+
     def get_status(self):
         s = time.strftime("%H:%M")
         if self.app.config["app"]["use_unicode_symbols"]:
@@ -86,14 +86,14 @@ class Linter(Module):
             return False
 
         editor = file.get_editor()
-        for line_no in range(len(editor.lines)):
-            line = editor.lines[line_no]
-            if line_no+1 in linting.keys():
-                line.linting = linting[line_no+1]
+        # Only lines with messages have linting metadata
+        editor.line_metadata.clear("linting")
+        editor.line_metadata.clear("number_color")
+        for line_no, messages in linting.items():
+            if 0 < line_no <= len(editor.lines):
+                line = editor.lines[line_no-1]
+                line.linting = messages
                 line.set_number_color(1)
-            else:
-                line.linting = False
-                line.reset_number_color()
 
     def get_msgs_on_line(self, editor, line_no):
         line = editor.lines[line_no]
@@ -102,12 +102,7 @@ class Linter(Module):
         return line.linting[0][1]
 
     def get_msg_count(self, editor):
-        count = 0
-        for line in editor.lines:
-            if hasattr(line, "linting"):
-                if line.linting:
-                    count += 1
-        return count
+        return len(editor.line_metadata.get_lines("linting"))
 
 
 class BaseLint:
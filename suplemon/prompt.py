@@ -34,6 +34,8 @@ class Prompt(Editor):
         """Set the configuration for the editor."""
         # Override showing line numbers
         config["show_line_nums"] = False
+        # Input is always on a single row
+        config["soft_wrap"] = False
         Editor.set_config(self, config)
 
     def set_input_source(self, input_func):
@@ -56,7 +58,13 @@ class Prompt(Editor):
         """Get the x coordinate of beginning of line."""
         return len(self.caption)+1
 
-    def render_line_contents(self, line, pos, x_offset, max_len):
+    def render(self):
+        """Render the prompt."""
+        # The status bar is drawn to the same window, so always render everything
+        self.redraw()
+        Editor.render(self)
+
+    def render_line_contents(self, line, pos, x_offset, max_len, tokens=None):
         """Render the prompt line."""
         x_offset = self.line_offset()
         # Render the caption
@@ -75,6 +83,10 @@ class Prompt(Editor):
 
         return Editor.handle_input(self, event)
 
+    def insert_text(self, data):
+        """Insert pasted text on the single line of the prompt."""
+        Editor.insert_text(self, " ".join(data.splitlines()))
+
     def get_input(self, caption="", initial=""):
         """Get text input from the user via the prompt."""
         self.caption = caption
@@ -140,7 +152,7 @@ class PromptBool(Prompt):
 class PromptPassword(Prompt):
     """An input prompt for passwords based on Prompt."""
 
-    def render_line_contents(self, line, pos, x_offset, max_len):
+    def render_line_contents(self, line, pos, x_offset, max_len, tokens=None):
         obscured = Line("*" * len(line))
         Prompt.render_line_contents(self, obscured, pos, x_offset, max_len)
 
@@ -0,0 +1,186 @@
+# -*- encoding: utf-8
+"""
+Search index for finding matches of patterns in a line buffer.
+"""
+
+import re
+import bisect
+from collections import OrderedDict
+
+from .buffer import ChangeTracker
+
+
+class SearchIndex(object):
+    """Finds and caches the matches of search patterns in a line buffer.
+
+    The buffer is split into blocks of lines which are searched in bulk with
+    a compiled pattern. Each block is searched as a single string with line
+    breaks, so patterns can match over several lines. Matches are cached per
+    pattern, and when lines are changed only the blocks around the changed
+    lines are searched again.
+    """
+
+    # Amount of lines in a block
+    block_size = 2048
+    # Amount of lines after a block that a match can extend to
+    context = 64
+    # Amount of patterns to keep matches cached for
+    max_patterns = 8
+
+    def __init__(self):
+        # Must be added to the line buffer to get notified of changes
+        self.tracker = ChangeTracker()
+        # Blocks as [line_count, matches] by pattern. The matches are (y, x)
+        # tuples relative to the block or None if the block isn't searched yet.
+        self.patterns = OrderedDict()
+
+    def compile(self, what, regex=False):
+        """Compile a search string to a pattern.
+
+        :param str what: String to search for.
+        :param bool regex: Whether what is a regular expression. Invalid
+            expressions are searched for as normal strings.
+        :return: The compiled pattern.
+        """
+        if regex:
+            try:
+                return re.compile(what, re.MULTILINE)
+            except re.error:
+                pass
+        return re.compile(re.escape(what))
+
+    def find(self, pattern, start=(0, 0)):
+        """Iterate over the matches of pattern at or after start.
+
+        :param pattern: Compiled pattern from compile().
+        :param tuple start: The (y, x) position to begin from.
+        :return: Generator of (y, x) tuples of match positions in order.
+        """
+        self._apply_changes()
+        blocks = self._get_blocks(pattern)
+        y, x = start
+        offset = 0
+        for block in blocks:
+            count = block[0]
+            if offset + count <= y:
+                offset += count
+                continue
+            if y >= offset:
+                # Search from the start, since the cached matches don't include
+                # matches that overlap an earlier match
+                for match in self._search_from(pattern, y, x, offset + count):
+                    yield match
+            else:
+                if block[1] is None:
+                    block[1] = self._search(pattern, offset, count)
+                for match in block[1]:
+                    yield (match[0] + offset, match[1])
+            offset += count
+
+    def _get_blocks(self, pattern):
+        key = (pattern.pattern, pattern.flags)
+        blocks = self.patterns.get(key)
+        if blocks is None:
+            blocks = self._new_blocks(len(self.tracker.buffer))
+            if len(self.patterns) >= self.max_patterns:
+                self.patterns.popitem(last=False)
+        else:
+            # Keep recently used patterns cached
+            del self.patterns[key]
+        self.patterns[key] = blocks
+        return blocks
+
+    def _new_blocks(self, count):
+        """Return unsearched blocks for count lines."""
+        blocks = []
+        while count > self.block_size:
+            blocks.append([self.block_size, None])
+            count -= self.block_size
+        blocks.append([count, None])
+        return blocks
+
+    def _search_from(self, pattern, y, x, stop):
+        """Iterate over the matches in the lines [y, stop) beginning at column x of line y.
+
+        The lines are searched in growing steps, so that finding the first
+        matches after a position doesn't require searching the whole block.
+        """
+        size = self.context
+        # Whether the first match is the last match of the previous step
+        skip = False
+        while y < stop:
+            count = min(size, stop - y)
+            matches = self._search(pattern, y, count, x)
+            if skip:
+                matches = matches[1:]
+            for match in matches:
+                yield (match[0] + y, match[1])
+            if matches:
+                # Continue from the last match, since it can extend past the searched lines
+                y, x = matches[-1][0] + y, matches[-1][1]
+                skip = True
+            else:
+                y, x = y + count, 0
+                skip = False
+            size = min(size * 2, self.block_size)
+
+    def _search(self, pattern, start, count, x=0):
+        """Search the lines [start, start+count) and return the matches relative to start.
+
+        :param int x: Column of the first line to begin searching from.
+        """
+        lines = self.tracker.buffer
+        length = len(lines)
+        stop = min(start + count + self.context, length)
+        data = list(lines.iter_data(start, stop))
+        # Offsets of the beginnings of lines in the searched text
+        offsets = []
+        offset = 0
+        for line in data:
+            offsets.append(offset)
+            offset += len(line) + 1
+        text = "\n".join(data)
+        if stop < length:
+            # Make the line break after the last line findable
+            text += "\n"
+        # Only matches that begin inside the block belong to it
+        limit = offsets[count] if count < len(offsets) else len(text) + 1
+        offsets.append(len(text) + 1)
+        matches = []
+        # Matches are found in order so the line can be tracked incrementally
+        y = 0
+        next_offset = offsets[1]
+        for match in pattern.finditer(text, min(x, len(data[0]))):
+            pos = match.start()
+            if pos >= limit:
+                break
+            if pos >= next_offset:
+                y = bisect.bisect_right(offsets, pos, y) - 1
+                next_offset = offsets[y + 1]
+            matches.append((y, pos - offsets[y]))
+        return matches
+
+    def _apply_changes(self):
+        """Forget matches near changed lines."""
+        changed = self.tracker.take()
+        if changed is None:
+            return
+        start, old_end, new_end = changed
+        # Matches that begin before the change can extend into it
+        low = max(0, start - self.context)
+        high = max(old_end, start + 1)
+        for blocks in self.patterns.values():
+            first = last = None
+            offset = 0
+            for i, block in enumerate(blocks):
+                end = offset + block[0]
+                if first is None and end > low:
+                    first = i
+                if offset < high:
+                    last = i
+                offset = end
+            if first is None:
+                first = len(blocks) - 1
+            last = max(first, last)
+            count = sum(block[0] for block in blocks[first:last + 1]) + new_end - old_end
+            blocks[first:last + 1] = self._new_blocks(count)
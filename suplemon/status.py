@@ -0,0 +1,101 @@
+# -*- encoding: utf-8
+"""
+Worker for updating status bar values of modules in the background.
+"""
+
+import time
+import logging
+import threading
+
+
+class StatusWorker(object):
+    """Updates the status bar values of modules on a worker thread.
+
+    Modules that set status_interval have their get_status() called every
+    status_interval seconds on the worker thread, so slow status values
+    (e.g. ones that run external programs) don't block rendering. The
+    latest values are cached and read by the UI when drawing status bars.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        # [module, interval, next_update] by module name
+        self.providers = {}
+        # Latest status values by module name
+        self.values = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = False
+        self.started = False
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+
+    def add(self, name, module, interval):
+        """Update the status of a module every interval seconds.
+
+        :param str name: Name of the module.
+        :param Module module: The module instance.
+        :param float interval: Seconds between updates.
+        """
+        with self.lock:
+            self.providers[name] = [module, interval, 0]
+        self.wakeup.set()
+
+    def remove(self, name):
+        """Stop updating the status of a module."""
+        with self.lock:
+            self.providers.pop(name, None)
+            self.values.pop(name, None)
+
+    def add_modules(self, modules):
+        """Update the status of the modules that have status_interval set.
+
+        Modules that no longer have a status value are removed, so this can
+        be called again when modules are reloaded. The worker is started when
+        there are modules to update.
+
+        :param dict modules: Module instances by name.
+        """
+        for name, module in modules.items():
+            if module.options["status"] and module.status_interval:
+                self.add(name, module, module.status_interval)
+            else:
+                self.remove(name)
+        if self.providers:
+            self.start()
+
+    def get(self, name):
+        """Return the latest status value of a module, or an empty string if there's none yet."""
+        return self.values.get(name, "")
+
+    def start(self):
+        if self.started:
+            return
+        self.started = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped = True
+        self.wakeup.set()
+
+    def _run(self):
+        while not self.stopped:
+            now = time.time()
+            with self.lock:
+                due = [(name, provider) for name, provider in self.providers.items() if provider[2] <= now]
+            for name, provider in due:
+                module, interval = provider[:2]
+                try:
+                    value = module.get_status()
+                except Exception:
+                    self.logger.exception("Getting the status of module '{0}' failed.".format(name))
+                    value = ""
+                with self.lock:
+                    if name not in self.providers:
+                        continue
+                    self.values[name] = value
+                    provider[2] = time.time() + interval
+            with self.lock:
+                next_update = min([provider[2] for provider in self.providers.values()] or [now + 60])
+            self.wakeup.wait(max(0, next_update - time.time()))
+            self.wakeup.clear()
@@ -101,6 +101,10 @@ class Storage:
 
 
 class Module:
+    # Seconds between updating the status bar value of the module on a worker
+    # thread. If None, get_status() is called whenever the status bar is drawn.
+    status_interval = None
+
     def __init__(self, app, name, options=None):
         self.app = app
         self.name = name
@@ -127,7 +131,11 @@ class Module:
         return self.options
 
     def get_status(self):
-        """Called by app when to get status bar contents."""
+        """Called by app when to get status bar contents.
+
+        If status_interval is set, this is called on a worker thread and
+        shouldn't change the app state.
+        """
         return ""
 
     def set_name(self, name):
@@ -3,6 +3,7 @@
 Theme loader
 """
 import os
+import curses
 import logging
 
 try:
@@ -48,6 +49,9 @@ scope_to_pair = {
     "entity.name.filename.find-in-files": 52,
 }
 
+# Color pair for whitespace
+whitespace_pair = 9
+
 
 class Theme:
     def __init__(self, name, uuid):
@@ -67,6 +71,10 @@ class ThemeLoader:
         # Module instances
         self.themes = {}
         self.current_theme = None
+        # Curses attributes of the scopes of the current theme
+        self.attributes = {}
+        # Curses attribute for whitespace
+        self.whitespace_attribute = 0
 
     def load(self, name):
         fullpath = "".join([self.theme_path, name, ".tmTheme"])
@@ -110,6 +118,53 @@ class ThemeLoader:
         if theme is None:
             return
         self.current_theme = theme
+        self.compile()
+
+    def compile(self):
+        """Resolve the scopes of the current theme to curses attributes.
+
+        A color pair is initialized for each scope in scope_to_pair that the
+        theme has settings for. This needs to be done again only when the
+        theme or the colors change, so rendering can just look up attributes.
+        """
+        self.attributes = {}
+        self.whitespace_attribute = curses.color_pair(whitespace_pair)
+        if not self.current_theme:
+            return
+        for scope, pair in scope_to_pair.items():
+            settings = self.get_scope_settings(scope)
+            if not settings:
+                continue
+            if self.init_pair(pair, settings.get("foreground"), settings.get("background")):
+                self.attributes[scope] = curses.color_pair(pair)
+        settings = self.current_theme.scopes.get("global")
+        if settings and settings.get("invisibles"):
+            self.init_pair(whitespace_pair, settings.get("invisibles"), settings.get("background"))
+
+    def init_pair(self, pair, fg, bg):
+        try:
+            curses.init_pair(pair, int(fg or -1), int(bg or -1))
+        except curses.error:
+            self.logger.warning("Failed to initialize color pair {0}.".format(pair))
+            return False
+        return True
+
+    def get_scope_settings(self, scope):
+        """Return the settings of the current theme for a scope.
+
+        Like in TextMate, scopes without settings of their own use the
+        settings of their nearest parent scope (e.g. 'constant.numeric' for
+        'constant.numeric.line-number'). Excluded scopes ('a - b') are ignored.
+        """
+        scopes = self.current_theme.scopes
+        if scopes.get(scope):
+            return scopes[scope]
+        scope = scope.split(" - ")[0]
+        while scope:
+            if scopes.get(scope):
+                return scopes[scope]
+            scope = scope.rpartition(".")[0]
+        return None
 
     def get_scope(self, name):
         if self.current_theme:
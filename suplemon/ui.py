@@ -19,13 +19,14 @@ curses = None
 class InputEvent:
     """Represents a keyboard or mouse event."""
     def __init__(self):
-        self.type = None  # 'key' or 'mouse'
+        self.type = None  # 'key', 'mouse' or 'paste'
         self.key_name = ""
         self.key_code = None
         self.is_typeable = False
         self.curses_key_name = None
         self.mouse_code = None
         self.mouse_pos = (0, 0)
+        self.text = None  # Pasted text
         self.logger = logging.getLogger("{0}.InputEvent".format(__name__))
 
     def parse_key_code(self, key_code):
@@ -40,6 +41,11 @@ class InputEvent:
         self.type = "key"
         self.key_name = name
 
+    def set_paste(self, text):
+        """Set the text of a paste event."""
+        self.type = "paste"
+        self.text = text
+
     def parse_mouse_state(self, state):
         """Parse curses mouse events."""
         self.type = "mouse"
@@ -97,12 +103,19 @@ class InputEvent:
             str(self.key_name),
             str(self.key_code),
             str(self.mouse_code),
-            str(self.mouse_pos)
+            str(self.mouse_pos),
+            str(len(self.text or "")),
         ]
         return " ".join(parts)
 
 
 class UI:
+    # Sequences the terminal sends around pasted text in bracketed paste mode
+    paste_start = "\x1b[200~"
+    paste_end = "\x1b[201~"
+    # Milliseconds to wait for the rest of a paste before giving up
+    paste_timeout = 1000
+
     def __init__(self, app):
         self.app = app
         self.logger = logging.getLogger(__name__)
@@ -114,6 +127,9 @@ class UI:
         self.status_win = None
         self.editor_win = None
         self.legend_win = None
+        self.bracketed_paste = False
+        # Contents of the top status bar when it was last drawn
+        self.top_status = None
 
     def init(self):
         """Set ESC delay and then import curses."""
@@ -139,7 +155,11 @@ class UI:
 
     def run(self, func):
         """Run the application main function via the curses wrapper for safety."""
-        curses.wrapper(func)
+        try:
+            curses.wrapper(func)
+        finally:
+            # Don't leave the terminal in bracketed paste mode after crashing
+            self.set_bracketed_paste(False)
 
     def load(self, *args):
         """Setup curses."""
@@ -164,6 +184,7 @@ class UI:
             self.logger.warning("Using old curses! Some keys and special characters might not work.")
 
         self.screen.keypad(1)
+        self.set_bracketed_paste(self.app.config["app"].get("bracketed_paste", True))
 
         self.current_yx = self.screen.getmaxyx()  # For checking resize
         self.setup_mouse()
@@ -171,8 +192,22 @@ class UI:
 
     def unload(self):
         """Unload curses."""
+        self.set_bracketed_paste(False)
         curses.endwin()
 
+    def set_bracketed_paste(self, enabled):
+        """Enable or disable bracketed paste mode in the terminal.
+
+        In bracketed paste mode the terminal marks the beginning and end of
+        pasted text, so that it can be inserted all at once instead of
+        handling it as individual key presses.
+        """
+        if enabled == self.bracketed_paste:
+            return
+        self.bracketed_paste = enabled
+        sys.stdout.write("\x1b[?2004h" if enabled else "\x1b[?2004l")
+        sys.stdout.flush()
+
     def setup_mouse(self):
         # Mouse support
         curses.mouseinterval(10)
@@ -261,6 +296,8 @@ class UI:
         # https://anonscm.debian.org/cgit/collab-maint/ncurses.git/tree/ncurses/base/resizeterm.c#n274
         # https://anonscm.debian.org/cgit/collab-maint/ncurses.git/tree/ncurses/base/wresize.c#n87
         self.text_input = None
+        # Status bars need to be drawn again after resizing
+        self.top_status = None
 
         offset_top = 0
         offset_bottom = 0
@@ -341,7 +378,6 @@ class UI:
 
     def show_top_status(self):
         """Show top status row."""
-        self.header_win.erase()
         size = self.get_size()
         display = self.app.config["display"]
         head_parts = []
@@ -357,13 +393,19 @@ class UI:
         for name in module_keys:
             module = self.app.modules.modules[name]
             if module.options["status"] == "top":
-                status = module.get_status()
+                status = self.get_module_status(name, module)
                 if status:
                     head_parts.append(status)
 
         if display["show_file_list"]:
             head_parts.append(self.file_list_str())
 
+        # Only draw the status bar when its contents change
+        key = (head_parts, size, display["invert_status_bars"])
+        if key == self.top_status:
+            return
+        self.top_status = key
+        self.header_win.erase()
         head = " ".join(head_parts)
         head = head + (" " * (size[0]-wcswidth(head)-1))
         head_width = wcswidth(head)
@@ -378,6 +420,15 @@ class UI:
             pass
         self.header_win.refresh()
 
+    def get_module_status(self, name, module):
+        """Return the status bar value of a module.
+
+        Values of modules with a status_interval are updated in the background.
+        """
+        if module.status_interval:
+            return self.app.status_worker.get(name)
+        return module.get_status()
+
     def file_list_str(self):
         """Return rotated file list beginning at current file as a string."""
         curr_file_index = self.app.current_file_index()
@@ -411,13 +462,18 @@ class UI:
             str(len(editor.cursors)),
             str(len(editor.get_buffer()))
         )
+        f = self.app.get_file()
+        if f.is_loading():
+            status_str = "loading:{0}% ".format(int(f.get_load_progress() * 100)) + status_str
+        elif f.is_saving():
+            status_str = "saving:{0}% ".format(int(f.get_save_progress() * 100)) + status_str
 
         # Add module statuses to the status bar
         module_str = ""
         for name in self.app.modules.modules.keys():
             module = self.app.modules.modules[name]
             if module.options["status"] == "bottom":
-                module_str += " " + module.get_status()
+                module_str += " " + self.get_module_status(name, module)
         status_str = module_str + " " + status_str
 
         self.status_win.erase()
@@ -556,8 +612,12 @@ class UI:
         result = self._query(text, initial, inst=prompt_inst)
         return result
 
-    def get_input(self, blocking=True):
-        """Get an input event from keyboard or mouse. Returns an InputEvent instance or False."""
+    def get_input(self, blocking=True, timeout=None):
+        """Get an input event from keyboard or mouse. Returns an InputEvent instance or False.
+
+        :param bool blocking: Wait for input.
+        :param int timeout: Maximum time to wait for input in milliseconds when blocking.
+        """
         event = InputEvent()  # Initialize new empty event
         char = False
         input_func = None
@@ -568,7 +628,9 @@ class UI:
             # Old Python fallback. No multibyte characters.
             input_func = self.screen.getch
         try:
-            if blocking:
+            if blocking and timeout is not None:
+                self.screen.timeout(timeout)
+            elif blocking:
                 self.screen.nodelay(0)
             else:
                 self.screen.nodelay(1)
@@ -583,6 +645,12 @@ class UI:
         finally:
             self.screen.nodelay(0)
 
+        if self.bracketed_paste and char in ("\x1b", 27):
+            text = self._read_paste(input_func)
+            if text is not None:
+                event.set_paste(text)
+                return event
+
         if char and char != -1:
             if self.is_mouse(char):
                 state = self.get_mouse_state()
@@ -594,6 +662,68 @@ class UI:
                 return event
         return False
 
+    def _read_paste(self, input_func):
+        """Read pasted text if the escape key that was just read begins a paste.
+
+        :param input_func: Function for reading a character.
+        :return: The pasted text or None if the input isn't a paste. Characters
+            that were read are put back in the input queue in that case.
+        """
+        read = []
+        try:
+            self.screen.nodelay(1)
+            for expected in self.paste_start[1:]:
+                char = self._read_char(input_func)
+                if char is None:
+                    break
+                read.append(char)
+                if isinstance(char, int):
+                    char = chr(char) if char < 256 else None
+                if char != expected:
+                    break
+            else:
+                return self._read_paste_text(input_func)
+        finally:
+            self.screen.nodelay(0)
+        # Not a paste, so the characters belong to other keys
+        for char in reversed(read):
+            if isinstance(char, str) and "unget_wch" in dir(curses):
+                curses.unget_wch(char)
+            else:
+                curses.ungetch(char)
+        return None
+
+    def _read_paste_text(self, input_func):
+        """Read pasted text until the end of the paste."""
+        chars = []
+        end = list(self.paste_end)
+        self.screen.timeout(self.paste_timeout)
+        while True:
+            char = self._read_char(input_func)
+            if char is None:
+                self.logger.warning("Bracketed paste ended without the end sequence.")
+                break
+            if isinstance(char, int):
+                if char > 255:
+                    # Special keys can't be part of the text
+                    continue
+                char = chr(char)
+            chars.append(char)
+            if char == "~" and chars[-len(end):] == end:
+                del chars[-len(end):]
+                break
+        return "".join(chars)
+
+    def _read_char(self, input_func):
+        """Read a character with input_func or return None if there's no input."""
+        try:
+            char = input_func()
+        except curses.error:
+            return None
+        if char == -1:
+            return None
+        return char
+
     def is_mouse(self, key):
         """Check for mouse events"""
         return key == curses.KEY_MOUSE
@@ -615,8 +745,5 @@ class UI:
         x, y = (state[1], state[2])
         if self.app.config["display"]["show_top_bar"]:
             y -= 1
-        x -= editor.line_offset() - editor.x_scroll
-        if x < 0:
-            x = 0
-        y += editor.y_scroll
+        x, y = editor.get_position_at(x, y)
         return (state[0], x, y, state[3], state[4])
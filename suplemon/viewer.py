@@ -6,6 +6,7 @@ Text viewer component subclassed by Editor.
 import os
 import re
 import sys
+import bisect
 import curses
 import logging
 try:
@@ -13,21 +14,35 @@ try:
 except ImportError:
     importlib = False
 
+from wcwidth import wcwidth, wcswidth
+
 from . import helpers
+from . import buffer
 
-from .line import Line
-from .cursor import Cursor
-from .themes import scope_to_pair
+from .line import Line, LineMetadata
+from .cursor import Cursor, CursorSet
+from .search import SearchIndex
+from .wrap import WrapIndex, wrap_line
 import suplemon.linelight  # NOQA
 
 try:
     import pygments.lexers
-    from .lexer import Lexer
+    from .lexer import Lexer, TokenCache, FindInFilesLexer
 except ImportError:
     pygments = False
 
+# The viewer that last rendered to each curses window by window id
+window_owners = {}
+
+
+class BaseViewer(object):
+    # Maximum amount of lines to keep prepared for displaying
+    max_display_cache = 10000
+    # Characters lexed before the visible part of long lines for the lexer to catch up with the syntax
+    long_line_lookbehind = 500
+    # Where lexing long lines may start, chosen to make starting inside a string unlikely
+    long_line_boundary = re.compile(r"[;\s]")
 
-class BaseViewer:
     def __init__(self, app, window):
         """
         Handle Viewer initialization
@@ -40,7 +55,12 @@ class BaseViewer:
         self.logger = logging.getLogger(__name__)
         self.config = {}
         self.data = ""
+        # Attributes of lines such as the line number color
+        self.line_metadata = LineMetadata()
+        self._lines = None
         self.lines = [Line()]
+        # Whether the contents are a read only view of a file
+        self.read_only = False
         self.file_extension = ""
 
         # Map special extensions to generic ones for highlighting
@@ -56,7 +76,24 @@ class BaseViewer:
 
         self.y_scroll = 0
         self.x_scroll = 0
+        self._cursors = None
         self.cursors = [Cursor()]
+        # Rows drawn by the last render and the state they were drawn with
+        self.rendered_rows = None
+        self.rendered_frame = None
+        self.rendered_y_scroll = 0
+        # (line_number, start, end) of the line segment on each row of the last render
+        self.rendered_segments = []
+        # Screen rows of lines when long lines are wrapped, see setup_wrap
+        self.wrap_index = None
+        # Whitespace translation tables by show_white_space, compiled in set_config
+        self.whitespace_tables = {False: {}, True: {}}
+        # (key, replacement) pairs by show_white_space for keys longer than one character
+        self.whitespace_replacements = {False: [], True: []}
+        # Cached (display_string, width) tuples by line data
+        self.display_cache = {}
+        # Settings that the cached display strings were prepared with
+        self.display_cache_settings = None
 
         # Copy/paste buffer
         self.buffer = []
@@ -85,6 +122,10 @@ class BaseViewer:
 
         self.pygments_syntax = None  # Needs to be implemented in derived classes
         self.lexer = None  # Needs to be implemented in derived classes
+        self.token_cache = None  # Caches tokens for Pygments highlighting
+        # Finds and caches matches for searching
+        self.search_index = SearchIndex()
+        self.lines.add_tracker(self.search_index.tracker)
 
     def init(self):
         pass
@@ -113,37 +154,53 @@ class BaseViewer:
         self.y_scroll = pos[0]
         self.x_scroll = pos[1]
 
+    @property
+    def cursors(self):
+        return self._cursors
+
+    @cursors.setter
+    def cursors(self, cursors):
+        if not isinstance(cursors, CursorSet):
+            cursors = CursorSet(cursors)
+        self._cursors = cursors
+
+    @property
+    def lines(self):
+        return self._lines
+
+    @lines.setter
+    def lines(self, lines):
+        if not isinstance(lines, buffer.LineBuffer):
+            lines = self.new_line_buffer(lines)
+        if self._lines is not None and self._lines is not lines:
+            lines.adopt_trackers(self._lines)
+        lines.metadata = self.line_metadata
+        self._lines = lines
+
+    def new_line_buffer(self, lines=None):
+        """Create a line buffer with the configured backend.
+
+        :param lines: Optional iterable of strings or Line instances.
+        :return: The new line buffer.
+        """
+        backend = buffer.backends.get(self.config.get("line_buffer"), buffer.ChunkedLineBuffer)
+        return backend(lines)
+
     def get_cursor(self):
         """Return the main cursor."""
         return self.cursors[0]
 
     def get_first_cursor(self):
         """Get the first (primary) cursor."""
-        highest = None
-        for cursor in self.cursors:
-            if highest is None or cursor.y < highest.y:
-                highest = cursor
-        return highest
+        return self.cursors.first()
 
     def get_last_cursor(self):
         """Get the last cursor."""
-        lowest = None
-        for cursor in self.cursors:
-            if lowest is None:
-                lowest = cursor
-            elif cursor.y > lowest.y:
-                lowest = cursor
-            elif cursor.y == lowest.y and cursor.x > lowest.x:
-                lowest = cursor
-        return lowest
+        return self.cursors.last()
 
     def get_cursors_on_line(self, line_no):
         """Return all cursors on a specific line."""
-        cursors = []
-        for cursor in self.cursors:
-            if cursor.y == line_no:
-                cursors.append(cursor)
-        return cursors
+        return self.cursors.on_line(line_no)
 
     def get_line(self, n):
         """Return line at index n.
@@ -159,12 +216,7 @@ class BaseViewer:
         :return: A list of line numbers that have cursors.
         :rtype: list
         """
-        line_nums = []
-        for cursor in self.cursors:
-            if cursor.y not in line_nums:
-                line_nums.append(cursor.y)
-        line_nums.sort()
-        return line_nums
+        return self.cursors.line_numbers()
 
     def get_data(self):
         """Get editor contents.
@@ -172,29 +224,51 @@ class BaseViewer:
         :return: Editor contents.
         :rtype: str
         """
-        str_lines = []
-        for line in self.lines:
-            if isinstance(line, str):
-                str_lines.append(line)
-            else:
-                str_lines.append(line.get_data())
-        data = str(self.config["end_of_line"].join(str_lines))
+        data = str(self.config["end_of_line"].join(self.lines.iter_data()))
         return data
 
+    def get_lines(self):
+        """Get editor contents as a list of line strings.
+
+        :return: A copy of the lines that isn't affected by further editing.
+        :rtype: list
+        """
+        return list(self.lines.iter_data())
+
     def set_data(self, data):
         """Set editor data or contents.
 
         :param str data: Set the editor contents to data.
         """
         self.data = data
-        self.lines = []
         lines = self.data.splitlines()
         # splitlines doesn't return the last line if it's empty so we add a line
         # if there we're no lines at all or if the data ends with a new line
         if not len(lines) or self.data.endswith(("\n", "\r\n", "\r")):
-            lines.append(Line())
-        for line in lines:
-            self.lines.append(Line(line))
+            lines.append("")
+        # The buffer wraps the strings into Line instances when needed
+        self.read_only = False
+        self.lines = self.new_line_buffer(lines)
+
+    def set_mapped_data(self, path, encoding="utf-8"):
+        """View a file through a read only memory mapped line buffer.
+
+        Lines are decoded only when they are accessed, so huge files can be
+        viewed without reading them into memory.
+
+        :param str path: Path of the file to view.
+        :param str encoding: Encoding of the file. Must be ASCII compatible.
+        """
+        self.data = ""
+        self.read_only = True
+        self.lines = buffer.MappedLineBuffer(path, encoding)
+
+    def append_lines(self, lines):
+        """Append lines to the end of the contents.
+
+        :param list lines: Lines to append as strings.
+        """
+        self.lines.extend(lines)
 
     def set_config(self, config):
         """Set the viewer configuration dict.
@@ -203,6 +277,33 @@ class BaseViewer:
         """
         self.config = config
         self.set_cursor_style(self.config["cursor_style"])
+        self.compile_whitespace()
+        if self.token_cache:
+            self.token_cache.max_line_length = self.config.get("long_line_length", 0)
+        self.redraw()
+        # Switch the line buffer backend if it was changed
+        backend = buffer.backends.get(self.config.get("line_buffer"))
+        if backend and not self.read_only and type(self.lines) is not backend:
+            self.lines = backend(self.lines)
+        self.setup_wrap()
+
+    def setup_wrap(self):
+        """Start or stop wrapping long lines according to the 'soft_wrap' config."""
+        if self.config.get("soft_wrap"):
+            if self.wrap_index is None:
+                self.wrap_index = WrapIndex()
+                self.lines.add_tracker(self.wrap_index.tracker)
+                self.x_scroll = 0
+        elif self.wrap_index is not None:
+            self.lines.remove_tracker(self.wrap_index.tracker)
+            self.wrap_index = None
+
+    def get_wrap_index(self):
+        """Return the wrap index updated to the current width, or None if lines aren't wrapped."""
+        if self.wrap_index is None or self.read_only:
+            return None
+        self.wrap_index.set_width(self.max_line_length())
+        return self.wrap_index
 
     def set_cursor_style(self, cursor_style):
         """Set cursor style.
@@ -297,58 +398,182 @@ class BaseViewer:
             yx = self.window.getmaxyx()
         self.window.resize(yx[0], yx[1])
         self.move_cursors()
+        self.redraw()
         self.refresh()
 
+    def redraw(self):
+        """Render the whole window on the next render instead of only changed rows."""
+        self.rendered_rows = None
+
     def render(self):
-        """Render the editor curses window."""
+        """Render the editor curses window.
+
+        Rows are only rendered again when their contents, line number or
+        cursors have changed since the last render. When the view is scrolled
+        vertically the rows already on the screen are moved, so only the rows
+        that scroll into view are rendered. Everything is rendered if the
+        size, horizontal scrolling, theme or configuration changed or if
+        another viewer has rendered to the same window.
+
+        When long lines are wrapped each row shows a segment of a line, and
+        line numbers are only shown on the first row of each line.
+        """
         if self.app.block_rendering:
             return
 
-        self.window.erase()
         max_y = self.get_size()[1]
         max_len = self.max_line_length()
-        lnum_len = self.line_offset() - 1
+        x_offset = self.line_offset()
+        lnum_len = x_offset - 1
         lnum_pad = ">" if self.config["line_nums_pad_space"] else "0"
-        # Iterate through visible lines
+        tokens = None
+        if self._use_pygments():
+            tokens = self.token_cache.get_tokens(self.y_scroll, self.y_scroll + max_y)
+
+        wrap = self.get_wrap_index()
+        frame = (max_y, max_len, x_offset, self.x_scroll, self.show_line_ends,
+                 self.app.themes.current_theme, dict(self.config))
+        rows = self.rendered_rows
+        if rows is None or frame != self.rendered_frame or window_owners.get(id(self.window)) is not self:
+            self.window.erase()
+            rows = [None] * max_y
+            window_owners[id(self.window)] = self
+        elif self.y_scroll != self.rendered_y_scroll:
+            delta = self.y_scroll - self.rendered_y_scroll
+            if wrap:
+                delta = wrap.row_of(self.y_scroll) - wrap.row_of(self.rendered_y_scroll)
+            rows = self._scroll_rows(rows, delta)
+
+        lines = self.lines[self.y_scroll:self.y_scroll + max_y]
+        segments = self._get_segments(lines, max_y, max_len if wrap else None)
+
+        # Cursor x positions by line number
+        cursor_lines = {}
+        for cursor in self.cursors:
+            cursor_lines[cursor.y] = cursor_lines.get(cursor.y, ()) + (cursor.x,)
+
+        # Iterate through visible rows
         for i in range(max_y):
-            x_offset = self.line_offset()
-            lnum = i + self.y_scroll
-            if lnum >= len(self.lines):  # Make sure we have a line to show
-                break
+            if i >= len(segments):  # Make sure we have a line to show
+                if rows[i] is not None:
+                    self.window.move(i, 0)
+                    self.window.clrtoeol()
+                    rows[i] = None
+                continue
 
             # Get line for current row
-            line = self.lines[lnum]
+            lnum, start, end = segments[i]
+            line = lines[lnum - self.y_scroll]
+            line_tokens = tokens[lnum - self.y_scroll] if tokens else None
+            line_cursors = cursor_lines.get(lnum)
+            if wrap and line_cursors:
+                line_cursors = tuple(x for x in line_cursors if start <= x < end)
+            is_current = self.config["highlight_current_line"] and lnum in cursor_lines
+            row = (lnum, start, line.get_data(), line.number_color, is_current, line_cursors, line_tokens)
+            if row == rows[i]:
+                continue  # Nothing changed
+            rows[i] = row
+            self.window.move(i, 0)
+            self.window.clrtoeol()
 
             attribs = None
-            if self.config["highlight_current_line"] and self._is_current_line(i):
+            if is_current:
                 # Highlight current line by adding bold to background attribute set
                 attribs = self.window.getbkgd()
                 self.window.bkgdset(" ", attribs | curses.A_BOLD)
 
             if self.config["show_line_nums"]:
                 curs_color = curses.color_pair(line.number_color)
-                padded_num = "{:{}{}d} ".format(lnum + 1, lnum_pad, lnum_len)
+                if start == 0:
+                    padded_num = "{:{}{}d} ".format(lnum + 1, lnum_pad, lnum_len)
+                else:
+                    padded_num = " " * x_offset
                 self.window.addstr(i, 0, padded_num, curs_color)
 
             pos = (x_offset, i)
+            x_scroll = self.x_scroll
             try:
-                self.render_line_contents(line, pos, x_offset, max_len)
+                if wrap:
+                    # Render the segment as if the line was scrolled to its start
+                    self.x_scroll = start
+                self.render_line_contents(line, pos, x_offset, max_len, line_tokens)
             except:
                 self.logger.error("Failed rendering line #{0} @{1} DATA:'{2}'!".format(lnum+1, pos, line),
                                   exc_info=True)
+            finally:
+                self.x_scroll = x_scroll
             if attribs is not None:
                 # Restore background attribute set
                 self.window.bkgdset(" ", attribs)
 
+        self.rendered_rows = rows
+        self.rendered_frame = frame
+        self.rendered_y_scroll = self.y_scroll
+        self.rendered_segments = segments
         self.render_cursors()
+        # Unchanged rows may have been overwritten on the screen by other
+        # windows, so make sure the whole window is copied on refresh.
+        self.window.touchwin()
 
-    def _is_current_line(self, y):
-        for cursor in self.cursors:
-            if cursor.y - self.y_scroll == y:
-                return True
-        return False
+    def _get_segments(self, lines, max_y, width=None):
+        """Return the line segments to show on the rows of the view.
+
+        :param list lines: The visible lines, starting at y_scroll.
+        :param int max_y: Amount of rows in the view.
+        :param int width: Width to wrap lines to, or None if lines aren't wrapped.
+        :return: List of (line_number, start, end) tuples, one for each row.
+        """
+        if width is None:
+            return [(self.y_scroll + i, 0, len(line) + 1) for i, line in enumerate(lines)]
+        segments = []
+        for i, line in enumerate(lines):
+            offsets = wrap_line(line.get_data(), width, max_y - len(segments)) + [len(line) + 1]
+            for j in range(len(offsets) - 1):
+                segments.append((self.y_scroll + i, offsets[j], offsets[j + 1]))
+            if len(segments) >= max_y:
+                return segments[:max_y]
+        return segments
+
+    def _scroll_rows(self, rows, delta):
+        """Scroll the window contents by delta rows.
+
+        The terminal is allowed to scroll with line insert and delete
+        operations, so the moved rows don't need to be sent again.
+
+        :param list rows: The rows drawn by the last render.
+        :param int delta: Amount of rows to scroll down (or up if negative).
+        :return: The rows moved to their new positions, None for rows that need rendering.
+        """
+        if abs(delta) >= len(rows):
+            self.window.erase()
+            return [None] * len(rows)
+        self.window.idlok(True)
+        self.window.scrollok(True)
+        self.window.scroll(delta)
+        # Writing to the last cell mustn't scroll the window
+        self.window.scrollok(False)
+        if delta > 0:
+            return rows[delta:] + [None] * delta
+        return [None] * -delta + rows[:delta]
+
+    def _use_pygments(self):
+        """Check if lines should be rendered with Pygments highlighting."""
+        show_highlighting = self.config["show_highlighting"]
+        # Highlighting read only views would require lexing the whole file
+        return bool(pygments and show_highlighting and self.pygments_syntax and self.token_cache and
+                    self.app.themes.current_theme and not self.read_only)
+
+    def is_long_line(self, line):
+        """Check if a line is too long to be prepared for rendering as a whole.
+
+        Only the visible part of long lines is copied, lexed and rendered,
+        so their rendering cost doesn't depend on their length.
 
-    def render_line_contents(self, line, pos, x_offset, max_len):
+        :param line: Line instance or line data.
+        """
+        return 0 < self.config.get("long_line_length", 0) < len(line)
+
+    def render_line_contents(self, line, pos, x_offset, max_len, tokens=None):
         """Render the contents of a line to the screen
 
         Renders a line to the screen with the appropriate rendering method
@@ -358,68 +583,97 @@ class BaseViewer:
         :param pos: Position (x, y) for beginning of line.
         :param x_offset: Offset from left edge of screen. Currently same as x position.
         :param max_len: Maximum amount of chars that will fit on screen.
+        :param tokens: Optional list of (scope, word) tuples for the line from the token cache.
         """
-        show_highlighting = self.config["show_highlighting"]
-        if pygments and show_highlighting and self.pygments_syntax and self.app.themes.current_theme:
-            self.render_line_pygments(line, pos, x_offset, max_len)
+        if self._use_pygments():
+            self.render_line_pygments(line, pos, x_offset, max_len, tokens)
         elif self.config["show_line_colors"]:
             self.render_line_linelight(line, pos, x_offset, max_len)
         else:
             self.render_line_normal(line, pos, x_offset, max_len)
 
-    def render_line_pygments(self, line, pos, x_offset, max_len):
+    def render_line_pygments(self, line, pos, x_offset, max_len, tokens=None):
         """Render line with Pygments syntax highlighting."""
         x, y = pos
-        line_data = line.get_data()
-        # Lazily prepare and slice the line,
-        # even though it affects highlighting.
-        line_data = self._prepare_line_for_rendering(line_data,
-                                                     max_len,
-                                                     no_wspace=True)
-        # TODO:
-        # 1) The line should not be prepared for rendering like this
-        #    because it can get sliced. Sliced lines won't always get
-        #    completely highlighted (partial words). Syntax highlighting
-        #    should be done first and then only render visible words.
-        # 2) Additionaly highlighing should be done for all lines at once
-        #    and tokens should be cached in line instances. That way we can
-        #    support multi line comment syntax etc. It should also perform
-        #    better, since we only need to re-highlight lines when they change.
-        # TODO 2: Optimize lexer performance
-        tokens = self.lexer.lex(line_data, self.pygments_syntax)
+        data = line.get_data()
+        long_line = self.is_long_line(data)
+        # Position of the first token in the line
+        offset = 0
+        if tokens is None:
+            if long_line:
+                # Only lex the visible part and some context before it
+                offset = max(0, self.x_scroll - self.long_line_lookbehind)
+                boundary = offset and self.long_line_boundary.search(data, offset, self.x_scroll)
+                if boundary:
+                    offset = boundary.end()
+                data = data[offset:self.x_scroll + max_len]
+            # Lex the line on its own without the state of previous lines
+            tokens = self.lexer.lex_line(data, self.pygments_syntax)[0]
+        if tokens and not tokens[0][1].isspace():
+            # Split leading whitespace into its own token (e.g. inside multi line strings)
+            scope, text = tokens[0]
+            stripped = text.lstrip()
+            if stripped != text:
+                tokens = [("global", text[:len(text)-len(stripped)]), (scope, stripped)] + tokens[1:]
+        if self.show_line_ends and offset + len(data) == len(line):
+            tokens = tokens + [("global", self.config["line_end_char"])]
+        # Attributes of the theme scopes are compiled by the theme loader
+        themes = self.app.themes
+        # Lines with wide characters need to be clipped by their width on the screen
+        if long_line:
+            # Measuring the whole line would take too long, so always clip
+            wide = True
+        else:
+            display, width = self.get_display_line(data)
+            wide = width != len(display)
+        end = x_offset + max_len
+        # The whole line is highlighted and only visible parts are rendered
         first_token = True
-        for token in tokens:
-            if token[1] == "\n":
-                break
+        for token in self._slice_tokens_for_rendering(tokens, max_len, offset):
             scope = token[0]
             text = self.replace_whitespace(token[1])
-            if token[1].isspace() and not self.app.ui.limited_colors:
-                pair = 9  # Default to gray text on normal background
-                settings = self.app.themes.get_scope("global")
-                if settings and settings.get("invisibles"):
-                    fg = int(settings.get("invisibles") or -1)
-                    bg = int(settings.get("background") or -1)
-                    curses.init_pair(pair, fg, bg)
-                curs_color = curses.color_pair(pair)
+            text_width = len(text)
+            if wide:
+                text, text_width = self._clip_to_width(text, end - x_offset)
+                if not text:
+                    break
+            # Whitespace inside strings is colored like the string
+            if token[1].isspace() and (first_token or scope != "string") and not self.app.ui.limited_colors:
                 # Only add tab indicators to the inital whitespace
                 if first_token and self.config["show_tab_indicators"]:
                     text = self.add_tab_indicators(text)
-                self.window.addstr(y, x_offset, text, curs_color)
+                self.window.addstr(y, x_offset, text, themes.whitespace_attribute)
             else:
                 # Color with pygments
-                settings = self.app.themes.get_scope(scope)
-                pair = scope_to_pair.get(scope)
-                if settings and pair is not None:
-                    fg = int(settings.get("foreground") or -1)
-                    bg = int(settings.get("background") or -1)
-                    curses.init_pair(pair, fg, bg)
-                    curs_color = curses.color_pair(pair)
-                    self.window.addstr(y, x_offset, text, curs_color)
+                attribute = themes.attributes.get(scope)
+                if attribute is not None:
+                    self.window.addstr(y, x_offset, text, attribute)
                 else:
                     self.window.addstr(y, x_offset, text)
             if first_token:
                 first_token = False
-            x_offset += len(text)
+            x_offset += text_width
+
+    def _slice_tokens_for_rendering(self, tokens, max_len, offset=0):
+        """Return the parts of tokens that are visible after scrolling horizontally.
+
+        :param tokens: List of (scope, word) tuples.
+        :param max_len: Maximum length of line.
+        :param offset: Position of the first token in the line.
+        :return: List of (scope, word) tuples.
+        """
+        start = self.x_scroll
+        end = start + max_len
+        col = offset
+        visible = []
+        for scope, text in tokens:
+            next_col = col + len(text)
+            if next_col > start and text:
+                visible.append((scope, text[max(0, start-col):end-col]))
+            col = next_col
+            if col >= end:
+                break
+        return visible
 
     def get_line_color(self, line):
         raise NotImplementedError("Needs to be implemented in derived classes")
@@ -440,47 +694,118 @@ class BaseViewer:
         self.window.addstr(y, x_offset, line_data)
 
     def add_tab_indicators(self, data):
-        new_data = ""
-        i = 0
-        for char in data:
-            if i == 0:
-                new_data += self.config["tab_indicator_character"]
-            else:
-                new_data += char
-            i += 1
-            if i > self.config["tab_width"]-1:
-                i = 0
-        return new_data
+        """Replace the first character of every tab width in data with the tab indicator."""
+        tab_width = max(1, self.config["tab_width"])
+        indicator = self.config["tab_indicator_character"]
+        return "".join(indicator + data[i+1:i+tab_width] for i in range(0, len(data), tab_width))
+
+    def compile_whitespace(self):
+        """Compile the white space map of the config to translation tables for replace_whitespace."""
+        visible = {}
+        hidden = {}
+        replacements = {False: [], True: []}
+        for key, char in self.config["white_space_map"].items():
+            if len(key) != 1:
+                # Sequences of characters can't be translated, they're replaced instead
+                replacements[False].append((key, " "))
+                replacements[True].append((key, char))
+                continue
+            visible[ord(key)] = char
+            hidden[ord(key)] = " "
+        # Remove newlines, they cause curses errors
+        visible[ord("\n")] = None
+        hidden[ord("\n")] = None
+        self.whitespace_tables = {False: hidden, True: visible}
+        self.whitespace_replacements = replacements
+        self.display_cache = {}
 
     def replace_whitespace(self, data):
-        # TODO: Optimize performance
         """Replace unsafe whitespace with alternative safe characters
 
         Replace unsafe whitespace with normal space or visible replacement.
         For example tab characters make cursors go out of sync with line
         contents.
         """
-        for key in self.config["white_space_map"]:
-            char = " "
-            if self.config["show_white_space"]:
-                char = self.config["white_space_map"][key]
+        show = bool(self.config["show_white_space"])
+        for key, char in self.whitespace_replacements[show]:
             data = data.replace(key, char)
-        # Remove newlines, they cause curses errors
-        data = data.replace("\n", "")
-        return data
+        return data.translate(self.whitespace_tables[show])
+
+    def get_display_line(self, data):
+        """Return line data prepared for displaying and its width in terminal cells.
+
+        The line end character is added if line ends are shown and whitespace
+        is replaced with replace_whitespace. Results are cached by the line
+        contents, so changed lines are prepared again.
+
+        :param str data: Line data.
+        :return: Tuple (display_string, width).
+        """
+        settings = (self.config["show_white_space"], self.show_line_ends, self.config["line_end_char"])
+        if settings != self.display_cache_settings:
+            self.display_cache = {}
+            self.display_cache_settings = settings
+        result = self.display_cache.get(data)
+        if result is None:
+            display = data
+            if self.show_line_ends:
+                display += self.config["line_end_char"]
+            display = self.replace_whitespace(display)
+            width = wcswidth(display)
+            if width < 0:
+                # Non printable characters take no space
+                width = sum(max(0, wcwidth(char)) for char in display)
+            if len(self.display_cache) >= self.max_display_cache:
+                self.display_cache.clear()
+            result = (display, width)
+            self.display_cache[data] = result
+        return result
+
+    def _clip_to_width(self, data, max_width):
+        """Return the beginning of data that fits in max_width terminal cells.
+
+        :return: Tuple (data, width) with the clipped data and its width.
+        """
+        width = 0
+        for i, char in enumerate(data):
+            char_width = max(0, wcwidth(char))
+            if width + char_width > max_width:
+                return data[:i], width
+            width += char_width
+        return data, width
 
     def _prepare_line_for_rendering(self, line_data, max_len, no_wspace=False):
-        if self.show_line_ends:
-            line_data += self.config["line_end_char"]
-        line_data = self._slice_line_for_rendering(line_data, max_len)
-        if not no_wspace:
-            line_data = self.replace_whitespace(line_data)
+        if self.is_long_line(line_data):
+            return self._prepare_long_line_for_rendering(line_data, max_len, no_wspace)
+        if no_wspace:
+            if self.show_line_ends:
+                line_data += self.config["line_end_char"]
+            line_data = self._slice_line_for_rendering(line_data, max_len)
+        else:
+            display, width = self.get_display_line(line_data)
+            line_data = self._slice_line_for_rendering(display, max_len)
+            if width != len(display):
+                # Wide characters take more than one cell
+                line_data = self._clip_to_width(line_data, max_len)[0]
 
         # Use unicode support on Python 3.3 and higher
         if sys.version_info[0] == 3 and sys.version_info[1] > 2:
             line_data = line_data.encode("utf-8")
         return line_data
 
+    def _prepare_long_line_for_rendering(self, line_data, max_len, no_wspace=False):
+        """Prepare a long line for rendering without copying more than its visible part."""
+        end = self.x_scroll + max_len
+        visible = line_data[self.x_scroll:end]
+        if self.show_line_ends and self.x_scroll <= len(line_data) < end:
+            visible = (visible + self.config["line_end_char"])[:max_len]
+        line_data = visible
+        if not no_wspace:
+            line_data = self._clip_to_width(self.replace_whitespace(line_data), max_len)[0]
+        if sys.version_info[0] == 3 and sys.version_info[1] > 2:
+            line_data = line_data.encode("utf-8")
+        return line_data
+
     def _slice_line_for_rendering(self, line, max_len):
         """Return sliced line data.
 
@@ -504,6 +829,12 @@ class BaseViewer:
             return
 
         max_x, max_y = self.get_size()
+        if self.get_wrap_index():
+            for cursor in self.cursors:
+                pos = self.get_screen_position(cursor)
+                if pos and pos[0] < max_x:
+                    self.window.chgat(pos[1], pos[0], 1, self.cursor_style)
+            return
         for cursor in self.cursors:
             x = cursor.x - self.x_scroll + self.line_offset()
             y = cursor.y - self.y_scroll
@@ -517,6 +848,23 @@ class BaseViewer:
                 continue
             self.window.chgat(y, cursor.x+self.line_offset()-self.x_scroll, 1, self.cursor_style)
 
+    def get_screen_position(self, cursor):
+        """Return the (x, y) position of a cursor in the view, or None if it isn't visible."""
+        x_offset = self.line_offset()
+        for y, segment in enumerate(self.rendered_segments):
+            lnum, start, end = segment
+            if lnum == cursor.y and start <= cursor.x < end:
+                return (cursor.x - start + x_offset, y)
+        return None
+
+    def get_position_at(self, x, y):
+        """Return the (x, y) position in the buffer shown at a position in the view."""
+        x_offset = self.line_offset()
+        if self.get_wrap_index() and self.rendered_segments:
+            lnum, start, end = self.rendered_segments[min(y, len(self.rendered_segments) - 1)]
+            return (start + min(max(0, x - x_offset), end - start - 1), lnum)
+        return (max(0, x - x_offset + self.x_scroll), y + self.y_scroll)
+
     ###########################################################################
     # Scrolling
     ###########################################################################
@@ -532,6 +880,16 @@ class BaseViewer:
         """Scroll view up if neccesary."""
         cursor = self.get_last_cursor()
         size = self.get_size()
+        wrap = self.get_wrap_index()
+        if wrap:
+            # Count the rows down to the row of the cursor within its line
+            offsets = wrap_line(self.lines[cursor.y].get_data(), wrap.width)
+            row = wrap.row_of(cursor.y) + bisect.bisect_right(offsets, cursor.x) - 1
+            if row - wrap.row_of(self.y_scroll) >= size[1]:
+                line, row_in_line = wrap.line_at(row - size[1] + 1)
+                # Start from the first row of a line
+                self.y_scroll = min(cursor.y, line + 1 if row_in_line else line)
+            return
         if cursor.y - self.y_scroll >= size[1]:
             # Scroll down
             self.y_scroll = cursor.y - size[1]+1
@@ -540,6 +898,11 @@ class BaseViewer:
         """Center the viewport on line_no."""
         if line_no >= len(self.lines):
             line_no = len(self.lines)-1
+        wrap = self.get_wrap_index()
+        if wrap:
+            line, row_in_line = wrap.line_at(max(0, wrap.row_of(line_no) - int(self.get_size()[1] / 2)))
+            self.y_scroll = min(line_no, line + 1 if row_in_line else line)
+            return
         new_y = line_no - int(self.get_size()[1] / 2)
         if new_y < 0:
             new_y = 0
@@ -575,6 +938,11 @@ class BaseViewer:
                 cursor.x = min(cursor.persistent_x, len(self.lines[cursor.y]))
 
         cur = self.get_cursor()  # Main cursor
+        if self.get_wrap_index():
+            # Wrapped lines are never scrolled horizontally
+            self.x_scroll = 0
+            self.purge_cursors()
+            return
         size = self.get_size()
         offset = self.line_offset()
         # Check if we should scroll horizontally
@@ -589,23 +957,16 @@ class BaseViewer:
 
     def move_x_cursors(self, line, col, delta):
         """Move all cursors starting at line and col with delta on the x axis."""
-        for cursor in self.cursors:
-            if cursor.y == line:
-                if cursor.x > col:
-                    cursor.move_right(delta)
+        self.cursors.shift_x(line, col, delta)
 
     def move_y_cursors(self, line, delta, exclude=None):
         """Move all cursors starting at line and col with delta on the y axis.
         Exclude a cursor by passing it via the exclude argument."""
-        for cursor in self.cursors:
-            if cursor == exclude:
-                continue
-            if cursor.y > line:
-                cursor.move_down(delta)
+        self.cursors.shift_y(line, delta, exclude)
 
     def cursor_exists(self, cursor):
         """Check if a given cursor exists."""
-        return cursor.tuple() in [cur.tuple() for cur in self.cursors]
+        return cursor in self.cursors
 
     def remove_cursor(self, cursor):
         """Remove a cursor object from the cursor list."""
@@ -618,29 +979,18 @@ class BaseViewer:
 
     def purge_cursors(self):
         """Remove duplicate cursors that have the same position."""
-        new = []
-        # This sucks: can't use "if .. in .." for different instances (?)
-        # Use a reference list instead. FIXME: use a generator
-        ref = []
-        for cursor in self.cursors:
-            if not cursor.tuple() in ref:
-                ref.append(cursor.tuple())
-                new.append(cursor)
-        self.cursors = new
+        self.cursors.purge()
 
     def purge_line_cursors(self, line_no):
         """Remove all but first cursor on given line."""
-        line_cursors = []
-        for cursor in self.cursors:
-            if cursor.y == line_no:
-                line_cursors.append(cursor)
+        line_cursors = self.get_cursors_on_line(line_no)
         if len(line_cursors) < 2:
             return False
 
         # Leave the first cursor out
         line_cursors.pop(0)
         # Remove the rest
-        for line_cursors in cursor:
+        for cursor in line_cursors:
             self.remove_cursor(cursor)
         return True
 
@@ -825,50 +1175,17 @@ class BaseViewer:
 
     def find(self, what, findall=False):
         """Find what in data (from top to bottom). Adds a cursor when found."""
-        # Sorry for this colossal function
         if not what:
             return
         last_cursor = self.get_last_cursor()
-        y = last_cursor.y
+        pattern = self.search_index.compile(what, self.config["regex_find"])
 
-        found = False
+        # Collect matches starting from the last cursor until one without a cursor is found
         new_cursors = []
-        # Loop through all lines starting from the last cursor
-        while y < len(self.lines):
-            line = self.lines[y]
-            x_offset = 0  # Which character to begin searching from
-            if y == last_cursor.y:
-                # On the current line begin from the last cursor x pos
-                x_offset = last_cursor.x
-
-            # Find all occurances of search string
-            s = str(line[x_offset:])  # Data to search in
-            if y < len(self.lines)-1:  # Make line breaks findable (add them to all except last line)
-                s = s + "\n"
-            pattern = re.escape(what)  # Default to non regex pattern
-            if self.config["regex_find"]:
-                try:  # Try to search with the actual regex
-                    indices = [match.start() for match in re.finditer(what, s)]
-                except:  # Revert to normal search
-                    indices = [match.start() for match in re.finditer(pattern, s)]
-            else:
-                # Use normal search
-                indices = [match.start() for match in re.finditer(pattern, s)]
-
-            # Loop through the indices and add cursors if they don't exist yet
-            for i in indices:
-                new = Cursor(i+x_offset, y)
-                if not self.cursor_exists(new):
-                    found = True
-                    if new not in new_cursors:  # Make sure we don't get duplicates
-                        new_cursors.append(new)
-                    if not findall:
-                        break
-                if new not in new_cursors:
-                    new_cursors.append(new)
-            if found and not findall:
+        for y, x in self.search_index.find(pattern, (last_cursor.y, last_cursor.x)):
+            new_cursors.append(Cursor(x, y))
+            if (x, y) not in self.cursors and not findall:
                 break
-            y += 1
 
         if not new_cursors:
             self.app.set_status("Can't find '{0}'".format(what))
@@ -974,7 +1291,11 @@ class Viewer(BaseViewer):
         if ext in self.extension_map:
             ext = self.extension_map[ext]  # Use it
         try:
-            self.pygments_syntax = pygments.lexers.get_lexer_by_name(ext)
+            if ext == "find-in-files":
+                # Results of find in files aren't a language known to Pygments
+                self.pygments_syntax = FindInFilesLexer()
+            else:
+                self.pygments_syntax = pygments.lexers.get_lexer_by_name(ext)
             self.logger.debug("Loaded Pygments lexer '{0}'.".format(ext))
         except:
             self.logger.debug("Failed to load Pygments lexer '{0}'.".format(ext))
@@ -983,6 +1304,10 @@ class Viewer(BaseViewer):
             # Hack to highlight PHP even without <?php ?> tags
             self.pygments_syntax.options.update({"startinline": 1})
             self.pygments_syntax.startinline = 1
+        if self.token_cache:
+            self.lines.remove_tracker(self.token_cache.tracker)
+        self.token_cache = TokenCache(self.lexer, self.pygments_syntax, self.config.get("long_line_length", 0))
+        self.lines.add_tracker(self.token_cache.tracker)
 
     def get_line_color(self, raw_line):
         """Return a color based on line contents.
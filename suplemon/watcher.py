@@ -0,0 +1,216 @@
+# -*- encoding: utf-8
+"""
+Watcher for noticing when open files are changed by other programs.
+"""
+
+import os
+import sys
+import time
+import select
+import ctypes
+import ctypes.util
+import hashlib
+import logging
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+def get_state(path):
+    """Get the metadata of a file that changes when the file is written.
+
+    :param str path: Path of the file.
+    :return: Tuple (mtime, size, inode) or None if the file doesn't exist.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime, stat.st_size, stat.st_ino)
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """Get the SHA-1 hex digest of the contents of a file or None if it can't be read."""
+    digest = hashlib.sha1()
+    try:
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+    except (IOError, OSError):
+        return None
+    return digest.hexdigest()
+
+
+class Inotify(object):
+    """Minimal inotify interface for watching directories on Linux."""
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_NONBLOCK = os.O_NONBLOCK
+    IN_CLOEXEC = 0o2000000
+
+    # Changes to files in a directory, including files replaced by renaming
+    mask = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+    def __init__(self):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._init = libc.inotify_init1
+        self._init.argtypes = [ctypes.c_int]
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = self._init(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        # Watch descriptors by directory
+        self.watches = {}
+
+    def add(self, directory):
+        """Start watching a directory."""
+        if directory in self.watches:
+            return True
+        wd = self._add_watch(self.fd, directory.encode(sys.getfilesystemencoding()), self.mask)
+        if wd < 0:
+            return False
+        self.watches[directory] = wd
+        return True
+
+    def remove(self, directory):
+        """Stop watching a directory."""
+        wd = self.watches.pop(directory, None)
+        if wd is not None:
+            self._rm_watch(self.fd, wd)
+
+    def wait(self, timeout):
+        """Wait until something changes in the watched directories.
+
+        :param float timeout: Maximum time to wait in seconds.
+        :return: True if there were changes.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        # The events themselves aren't needed, only that something changed
+        try:
+            while os.read(self.fd, 65536):
+                pass
+        except OSError:
+            pass
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+
+class FileWatcher(object):
+    """Watches files for changes on a worker thread.
+
+    The expected state of each file is its metadata from get_state() and the
+    hash of its contents. The files are checked whenever inotify reports a
+    change in their directory, and every poll_interval seconds in case
+    inotify isn't available. When the metadata of a file changes, its
+    contents are hashed to tell if it really changed. Changed paths are put
+    in a queue to be handled in the main thread.
+    """
+
+    # Time in seconds to wait for more changes before checking the files
+    settle_time = 0.2
+
+    def __init__(self, poll_interval=2.0):
+        self.logger = logging.getLogger(__name__)
+        self.poll_interval = poll_interval
+        # Expected [state, digest] by path
+        self.files = {}
+        self.lock = threading.Lock()
+        self.changed = queue.Queue()
+        self.inotify = None
+        self.stopped = False
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+
+    def start(self):
+        try:
+            self.inotify = Inotify()
+        except (OSError, AttributeError):
+            self.logger.info("inotify isn't available, polling files for changes.")
+        self.thread.start()
+
+    def stop(self):
+        self.stopped = True
+
+    def watch(self, path, state, digest):
+        """Start watching a file or set its expected state.
+
+        :param str path: Path of the file.
+        :param tuple state: Metadata of the file from get_state().
+        :param str digest: Hash of the contents or None to treat any metadata change as a change.
+        """
+        with self.lock:
+            self.files[path] = [state, digest]
+            if self.inotify:
+                self.inotify.add(os.path.dirname(path))
+
+    def unwatch(self, path):
+        """Stop watching a file."""
+        with self.lock:
+            if self.files.pop(path, None) is None or not self.inotify:
+                return
+            directory = os.path.dirname(path)
+            if not any(os.path.dirname(other) == directory for other in self.files):
+                self.inotify.remove(directory)
+
+    def get_changed(self):
+        """Return a list of paths of files that have changed."""
+        paths = []
+        while True:
+            try:
+                paths.append(self.changed.get_nowait())
+            except queue.Empty:
+                return paths
+
+    def _run(self):
+        while not self.stopped:
+            if self.inotify:
+                if self.inotify.wait(self.poll_interval):
+                    # Check once after a burst of changes
+                    time.sleep(self.settle_time)
+                    self.inotify.wait(0)
+            else:
+                time.sleep(self.poll_interval)
+            try:
+                self._check()
+            except Exception:
+                self.logger.exception("Checking files for changes failed.")
+
+    def _check(self):
+        with self.lock:
+            files = [(path, entry[0], entry[1]) for path, entry in self.files.items()]
+        for path, state, digest in files:
+            current = get_state(path)
+            if current is None or current == state:
+                continue
+            # Only metadata might have changed, so compare the contents
+            new_digest = hash_file(path) if digest else None
+            with self.lock:
+                entry = self.files.get(path)
+                if entry is None or entry[0] != state:
+                    # The file was saved or closed in the meantime
+                    continue
+                entry[0] = current
+                if new_digest is not None and new_digest == digest:
+                    continue
+                entry[1] = new_digest
+            self.changed.put(path)
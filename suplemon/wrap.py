@@ -0,0 +1,213 @@
+# -*- encoding: utf-8
+"""
+Index of the screen rows taken by lines when long lines are wrapped.
+"""
+
+import re
+
+from wcwidth import wcwidth
+
+from .buffer import ChangeTracker
+
+# Matches characters that might not be one terminal cell wide
+_non_ascii = re.compile("[^\x00-\x7f]")
+
+
+def wrap_line(data, width, max_rows=None):
+    """Return the offsets in data where the rows of the wrapped line begin.
+
+    Lines are wrapped after the last character that fits in width terminal
+    cells. A cell is left free at the end of the last row for the cursor.
+
+    :param str data: Line data.
+    :param int width: Width of a row in terminal cells.
+    :param int max_rows: Optional maximum amount of rows, the rest of the line is ignored.
+    :return: List of offsets, starting with 0.
+    """
+    width = max(1, width)
+    end = len(data) + 1
+    if max_rows is not None:
+        end = min(end, max_rows * width)
+    if not _non_ascii.search(data, 0, end):
+        return list(range(0, end, width))
+    offsets = [0]
+    used = 0
+    for i, char in enumerate(data):
+        char_width = max(0, wcwidth(char))
+        if used and used + char_width > width:
+            if len(offsets) == max_rows:
+                return offsets
+            offsets.append(i)
+            used = 0
+        used += char_width
+    if used >= width and len(offsets) != max_rows:
+        offsets.append(len(data))
+    return offsets
+
+
+def count_rows(data, width):
+    """Return the amount of rows a line takes when wrapped to width terminal cells."""
+    if not _non_ascii.search(data):
+        return len(data) // max(1, width) + 1
+    return len(wrap_line(data, width))
+
+
+class WrapIndex(object):
+    """Maps the lines of a line buffer to the screen rows they take when wrapped.
+
+    The row counts of lines are stored in blocks, and the amount of lines and
+    rows in each block are indexed by Fenwick trees. This makes finding the
+    first row of a line or the line at a row O(log n). When lines are changed
+    only the changed lines are counted again. Everything is counted again
+    only when the width changes.
+    """
+
+    block_size = 512
+
+    def __init__(self):
+        # Must be added to the line buffer to get notified of changes
+        self.tracker = ChangeTracker()
+        # Width of a row in terminal cells
+        self.width = None
+        # Lists of row counts of lines, None if the lines need to be counted
+        self.blocks = None
+        self.line_tree = [0]
+        self.row_tree = [0]
+        self.step = 1
+
+    def set_width(self, width):
+        """Set the width of a row in terminal cells."""
+        if width != self.width:
+            self.width = width
+            self.blocks = None
+
+    def row_of(self, line):
+        """Return the first row of a line."""
+        self._update()
+        b, offset = self._locate_line(line)
+        return self._prefix(self.row_tree, b) + sum(self.blocks[b][:offset])
+
+    def line_at(self, row):
+        """Return the line at a row.
+
+        :param int row: The row.
+        :return: Tuple (line, row_in_line). Rows past the end are on the last line.
+        """
+        self._update()
+        b, remaining = self._locate(self.row_tree, row)
+        if b >= len(self.blocks):
+            # Past the end, so the last row of the last line
+            return self._prefix(self.line_tree, len(self.blocks)) - 1, self.blocks[-1][-1] - 1
+        line = self._prefix(self.line_tree, b)
+        for count in self.blocks[b]:
+            if remaining < count:
+                break
+            remaining -= count
+            line += 1
+        return line, remaining
+
+    def rows(self, line):
+        """Return the amount of rows a line takes."""
+        self._update()
+        b, offset = self._locate_line(line)
+        block = self.blocks[b]
+        return block[offset] if offset < len(block) else 1
+
+    def total_rows(self):
+        """Return the amount of rows all lines take."""
+        self._update()
+        return self._prefix(self.row_tree, len(self.blocks))
+
+    def _count(self, start, stop):
+        width = self.width
+        return [count_rows(data, width) for data in self.tracker.buffer.iter_data(start, stop)]
+
+    def _update(self):
+        """Count the rows of changed lines."""
+        if self.blocks is None:
+            self.tracker.reset()
+            counts = self._count(0, len(self.tracker.buffer))
+            self.blocks = self._split(counts) or [[]]
+            self._rebuild_index()
+            return
+        changed = self.tracker.take()
+        if changed is None:
+            return
+        start, old_end, new_end = changed
+        b0, o0 = self._locate_line(start)
+        b1, o1 = self._locate_line(old_end)
+        counts = self._count(start, new_end)
+        if b0 == b1:
+            block = self.blocks[b0]
+            if len(block) + len(counts) - (o1 - o0) <= 2 * self.block_size:
+                # The change fits in the block, so only its totals change
+                row_delta = sum(counts) - sum(block[o0:o1])
+                block[o0:o1] = counts
+                self._add(self.line_tree, b0, new_end - old_end)
+                self._add(self.row_tree, b0, row_delta)
+                return
+        merged = self.blocks[b0][:o0] + counts + self.blocks[b1][o1:]
+        self.blocks[b0:b1 + 1] = self._split(merged)
+        if not self.blocks:
+            self.blocks = [[]]
+        self._rebuild_index()
+
+    def _split(self, counts):
+        size = self.block_size
+        return [counts[i:i + size] for i in range(0, len(counts), size)]
+
+    def _rebuild_index(self):
+        """Build the Fenwick trees of line and row counts of the blocks."""
+        n = len(self.blocks)
+        line_tree = [0] * (n + 1)
+        row_tree = [0] * (n + 1)
+        for b, block in enumerate(self.blocks):
+            i = b + 1
+            line_tree[i] += len(block)
+            row_tree[i] += sum(block)
+            parent = i + (i & -i)
+            if parent <= n:
+                line_tree[parent] += line_tree[i]
+                row_tree[parent] += row_tree[i]
+        self.line_tree = line_tree
+        self.row_tree = row_tree
+        self.step = 1
+        while self.step * 2 <= n:
+            self.step *= 2
+
+    def _add(self, tree, b, delta):
+        n = len(tree) - 1
+        i = b + 1
+        while i <= n:
+            tree[i] += delta
+            i += i & -i
+
+    def _prefix(self, tree, b):
+        """Return the sum of the first b blocks in tree."""
+        total = 0
+        while b > 0:
+            total += tree[b]
+            b -= b & -b
+        return total
+
+    def _locate(self, tree, value):
+        """Return the block where value falls in tree and the remainder within the block."""
+        n = len(tree) - 1
+        pos = 0
+        step = self.step
+        while step:
+            nxt = pos + step
+            if nxt <= n and tree[nxt] <= value:
+                pos = nxt
+                value -= tree[nxt]
+            step //= 2
+        return pos, value
+
+    def _locate_line(self, line):
+        """Return the block index and offset within the block for line."""
+        b, offset = self._locate(self.line_tree, line)
+        if b >= len(self.blocks):
+            # The end of the last block
+            b = len(self.blocks) - 1
+            offset = len(self.blocks[b])
+        return b, offset
@@ -8,4 +8,4 @@ if test "$SKIP_LINT" != "TRUE"; then
 fi
 
 # Run our tests
-# python setup.py nosetests
+python -m unittest discover -s tests
@@ -0,0 +1,51 @@
+# -*- encoding: utf-8
+"""
+Check that lexing lines gives the same tokens as lexing the whole text.
+"""
+
+import os
+import sys
+import unittest
+
+import pygments
+import pygments.lexers
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from suplemon.lexer import Lexer  # noqa: E402
+
+SAMPLES = {
+    "js": "/**\n * Doc comment\n */\nvar a = `x\n  y`;\nfunction f(b) {\n    return b; // c\n}",
+    "css": "/* a\n   b */\nbody {\n  color: red; /* c\n */\n}",
+    "c": "/* a\n * b\n */\nint main(void) {\n    return 0; /* x\n y */\n}",
+}
+
+
+class LexLinesTest(unittest.TestCase):
+    def setUp(self):
+        self.lexer = Lexer(None)
+
+    def lex_text(self, text, lex):
+        """Lex text with Pygments and split the tokens at line breaks like Lexer.lex_lines."""
+        lines = [[]]
+        for token, word in pygments.lex(text, lex):
+            scope = self.lexer.get_scope(token)
+            parts = word.split("\n")
+            lines[-1].append((scope, parts[0]))
+            for part in parts[1:]:
+                lines.append([(scope, part)])
+        # Drop the line after the final line break
+        lines = lines[:text.count("\n") + 1]
+        return [self.lexer._string_whitespace([item for item in line if item[1]]) for line in lines]
+
+    def test_multi_line_tokens(self):
+        for name, text in SAMPLES.items():
+            lex = pygments.lexers.get_lexer_by_name(name)
+            scopes = [item[0] for item in self.lexer.lex_lines(text.split("\n"), lex)]
+            self.assertEqual(scopes, self.lex_text(text, lex), name)
+            # The second line of each sample is inside a block comment
+            self.assertEqual([scope for scope, word in scopes[1]], ["comment"], name)
+
+
+if __name__ == "__main__":
+    unittest.main()